@@ -0,0 +1,212 @@
+""" The threshold detector's per sample work as one function over a block of samples.
+
+    All of the detector's state lives in a single int32 array, the workspace, so the kernel only
+    touches arrays and small ints: the moving average ring, both monotonic queues of the min-max
+    window, the hysteresis state and the last beat. That is what lets beat_kernel_viper.py compile
+    the same code with @micropython.viper. threshold_block below is the pure Python build. It is
+    used where viper is not available and keeps the two honest, they must agree bit for bit.
+
+    There is no division or modulo in the loop, ring positions wrap by compare and subtract,
+    because the RP2040 has no hardware divider. Values stay exact in 32 bits as long as
+    smoothing_window * 65535 * 100 fits, i.e. a smoothing window up to 327 samples """
+from array import array
+
+""" Workspace layout, beat_kernel_viper.py repeats these numbers as const() """
+TOTAL = 0
+SMOOTH_INDEX = 1
+SMOOTH_COUNT = 2
+RANGE_COUNT = 3
+MIN_HEAD = 4
+MIN_LEN = 5
+MAX_HEAD = 6
+MAX_LEN = 7
+BEAT_DETECTED = 8
+LAST_BEAT = 9
+ON_PERCENT = 10
+OFF_PERCENT = 11
+DEBOUNCE = 12
+SMOOTH_WINDOW = 13
+RANGE_WINDOW = 14
+HISTORY_HEAD = 15
+HISTORY_SIZE = 16
+START = 17
+COUNT = 18
+SEQ = 19
+SMOOTHED = 20
+SMOOTH_RING = 21
+MIN_INDEX = 22
+MIN_VALUES = 23
+MAX_INDEX = 24
+MAX_VALUES = 25
+BEATS_MAX = 26
+HEADER = 28
+
+MAX_SMOOTHING_WINDOW = 0x7FFFFFFF // (65535 * 100)
+
+def workspace(smoothing_window, threshold_window, on_percent, off_percent, debounce_samples, history_size, beats_max):
+    """ A workspace for the given detector settings, in the state reset() leaves it.
+        Raises ValueError for a smoothing window the 32 bit arithmetic cannot hold """
+    if smoothing_window > MAX_SMOOTHING_WINDOW:
+        raise ValueError("smoothing window of %d samples is over the %d that fit in 32 bits"
+                         % (smoothing_window, MAX_SMOOTHING_WINDOW))
+    size = HEADER + smoothing_window + 4 * threshold_window
+    work = array('i', [0] * size)
+    work[ON_PERCENT] = on_percent
+    work[OFF_PERCENT] = off_percent
+    work[DEBOUNCE] = debounce_samples
+    work[SMOOTH_WINDOW] = smoothing_window
+    work[RANGE_WINDOW] = threshold_window
+    work[HISTORY_SIZE] = history_size
+    work[BEATS_MAX] = beats_max
+    work[SMOOTH_RING] = HEADER
+    work[MIN_INDEX] = HEADER + smoothing_window
+    work[MIN_VALUES] = work[MIN_INDEX] + threshold_window
+    work[MAX_INDEX] = work[MIN_VALUES] + threshold_window
+    work[MAX_VALUES] = work[MAX_INDEX] + threshold_window
+    reset(work)
+    return work
+
+def reset(work):
+    """ Empties the moving average and the min-max window and forgets the last beat """
+    for i in range(TOTAL, MAX_LEN + 1):
+        work[i] = 0
+    ring = work[SMOOTH_RING]
+    for i in range(ring, ring + work[SMOOTH_WINDOW]):
+        work[i] = 0
+    work[BEAT_DETECTED] = 0
+    work[LAST_BEAT] = -1
+
+def threshold_block(work, data, history, beats):
+    """ Runs work[COUNT] samples of data from work[START], the first being sample number work[SEQ].
+        Smoothed values go into the history ring at work[HISTORY_HEAD] and their number into
+        work[SMOOTHED]. Beat sample numbers go into beats, the return value is how many """
+    w = work
+    d = data
+    h = history
+    b = beats
+    total = w[TOTAL]
+    s_index = w[SMOOTH_INDEX]
+    s_count = w[SMOOTH_COUNT]
+    r_count = w[RANGE_COUNT]
+    min_head = w[MIN_HEAD]
+    min_len = w[MIN_LEN]
+    max_head = w[MAX_HEAD]
+    max_len = w[MAX_LEN]
+    detected = w[BEAT_DETECTED]
+    last_beat = w[LAST_BEAT]
+    on_percent = w[ON_PERCENT]
+    off_percent = w[OFF_PERCENT]
+    debounce = w[DEBOUNCE]
+    s_window = w[SMOOTH_WINDOW]
+    r_window = w[RANGE_WINDOW]
+    h_head = w[HISTORY_HEAD]
+    h_size = w[HISTORY_SIZE]
+    ring = w[SMOOTH_RING]
+    min_index = w[MIN_INDEX]
+    min_values = w[MIN_VALUES]
+    max_index = w[MAX_INDEX]
+    max_values = w[MAX_VALUES]
+    beats_max = w[BEATS_MAX]
+    seq = w[SEQ]
+    i = w[START]
+    end = i + w[COUNT]
+    smoothed_count = 0
+    found = 0
+    while i < end:
+        value = int(d[i])
+        i += 1
+        """ Moving average """
+        total += value - w[ring + s_index]
+        w[ring + s_index] = value
+        s_index += 1
+        if s_index == s_window:
+            s_index = 0
+        if s_count < s_window:
+            s_count += 1
+            if s_count < s_window:
+                seq += 1
+                continue
+        smoothed = total
+        h[h_head] = smoothed
+        h_head += 1
+        if h_head == h_size:
+            h_head = 0
+        smoothed_count += 1
+
+        """ Min-max window """
+        oldest = r_count - r_window
+        if min_len > 0 and w[min_index + min_head] <= oldest:
+            min_head += 1
+            if min_head == r_window:
+                min_head = 0
+            min_len -= 1
+        if max_len > 0 and w[max_index + max_head] <= oldest:
+            max_head += 1
+            if max_head == r_window:
+                max_head = 0
+            max_len -= 1
+        while min_len > 0:
+            pos = min_head + min_len - 1
+            if pos >= r_window:
+                pos -= r_window
+            if w[min_values + pos] < smoothed:
+                break
+            min_len -= 1
+        pos = min_head + min_len
+        if pos >= r_window:
+            pos -= r_window
+        w[min_index + pos] = r_count
+        w[min_values + pos] = smoothed
+        min_len += 1
+        while max_len > 0:
+            pos = max_head + max_len - 1
+            if pos >= r_window:
+                pos -= r_window
+            if w[max_values + pos] > smoothed:
+                break
+            max_len -= 1
+        pos = max_head + max_len
+        if pos >= r_window:
+            pos -= r_window
+        w[max_index + pos] = r_count
+        w[max_values + pos] = smoothed
+        max_len += 1
+        r_count += 1
+
+        """ Threshold with hysteresis """
+        if r_count >= r_window:
+            minimum = w[min_values + min_head]
+            signal_range = w[max_values + max_head] - minimum
+            level = (smoothed - minimum) * 100
+            if detected == 0 and level > on_percent * signal_range and (last_beat < 0 or seq - last_beat >= debounce):
+                detected = 1
+                last_beat = seq
+                if found < beats_max:
+                    b[found] = seq
+                    found += 1
+            elif detected != 0 and level < off_percent * signal_range:
+                detected = 0
+        seq += 1
+
+    w[TOTAL] = total
+    w[SMOOTH_INDEX] = s_index
+    w[SMOOTH_COUNT] = s_count
+    w[RANGE_COUNT] = r_count
+    w[MIN_HEAD] = min_head
+    w[MIN_LEN] = min_len
+    w[MAX_HEAD] = max_head
+    w[MAX_LEN] = max_len
+    w[BEAT_DETECTED] = detected
+    w[LAST_BEAT] = last_beat
+    w[HISTORY_HEAD] = h_head
+    w[SEQ] = seq
+    w[SMOOTHED] = smoothed_count
+    return found
+
+python_threshold_block = threshold_block
+
+try:
+    from beat_kernel_viper import threshold_block
+except (ImportError, SyntaxError):
+    """ No micropython module, or a port built without the native emitter """
+    pass
@@ -0,0 +1,159 @@
+""" beat_kernel.threshold_block compiled to machine code with @micropython.viper.
+    The body is the pure Python one line for line, with the arrays cast to raw pointers,
+    so the two give the same smoothed values and beats. Keep them in step when changing either """
+import micropython
+from micropython import const
+
+_TOTAL = const(0)
+_SMOOTH_INDEX = const(1)
+_SMOOTH_COUNT = const(2)
+_RANGE_COUNT = const(3)
+_MIN_HEAD = const(4)
+_MIN_LEN = const(5)
+_MAX_HEAD = const(6)
+_MAX_LEN = const(7)
+_BEAT_DETECTED = const(8)
+_LAST_BEAT = const(9)
+_ON_PERCENT = const(10)
+_OFF_PERCENT = const(11)
+_DEBOUNCE = const(12)
+_SMOOTH_WINDOW = const(13)
+_RANGE_WINDOW = const(14)
+_HISTORY_HEAD = const(15)
+_HISTORY_SIZE = const(16)
+_START = const(17)
+_COUNT = const(18)
+_SEQ = const(19)
+_SMOOTHED = const(20)
+_SMOOTH_RING = const(21)
+_MIN_INDEX = const(22)
+_MIN_VALUES = const(23)
+_MAX_INDEX = const(24)
+_MAX_VALUES = const(25)
+_BEATS_MAX = const(26)
+
+@micropython.viper
+def threshold_block(work, data, history, beats) -> int:
+    """ See beat_kernel.threshold_block """
+    w = ptr32(work)
+    d = ptr16(data)
+    h = ptr32(history)
+    b = ptr32(beats)
+    total = w[_TOTAL]
+    s_index = w[_SMOOTH_INDEX]
+    s_count = w[_SMOOTH_COUNT]
+    r_count = w[_RANGE_COUNT]
+    min_head = w[_MIN_HEAD]
+    min_len = w[_MIN_LEN]
+    max_head = w[_MAX_HEAD]
+    max_len = w[_MAX_LEN]
+    detected = w[_BEAT_DETECTED]
+    last_beat = w[_LAST_BEAT]
+    on_percent = w[_ON_PERCENT]
+    off_percent = w[_OFF_PERCENT]
+    debounce = w[_DEBOUNCE]
+    s_window = w[_SMOOTH_WINDOW]
+    r_window = w[_RANGE_WINDOW]
+    h_head = w[_HISTORY_HEAD]
+    h_size = w[_HISTORY_SIZE]
+    ring = w[_SMOOTH_RING]
+    min_index = w[_MIN_INDEX]
+    min_values = w[_MIN_VALUES]
+    max_index = w[_MAX_INDEX]
+    max_values = w[_MAX_VALUES]
+    beats_max = w[_BEATS_MAX]
+    seq = w[_SEQ]
+    i = w[_START]
+    end = i + w[_COUNT]
+    smoothed_count = 0
+    found = 0
+    while i < end:
+        value = int(d[i])
+        i += 1
+        """ Moving average """
+        total += value - w[ring + s_index]
+        w[ring + s_index] = value
+        s_index += 1
+        if s_index == s_window:
+            s_index = 0
+        if s_count < s_window:
+            s_count += 1
+            if s_count < s_window:
+                seq += 1
+                continue
+        smoothed = total
+        h[h_head] = smoothed
+        h_head += 1
+        if h_head == h_size:
+            h_head = 0
+        smoothed_count += 1
+
+        """ Min-max window """
+        oldest = r_count - r_window
+        if min_len > 0 and w[min_index + min_head] <= oldest:
+            min_head += 1
+            if min_head == r_window:
+                min_head = 0
+            min_len -= 1
+        if max_len > 0 and w[max_index + max_head] <= oldest:
+            max_head += 1
+            if max_head == r_window:
+                max_head = 0
+            max_len -= 1
+        while min_len > 0:
+            pos = min_head + min_len - 1
+            if pos >= r_window:
+                pos -= r_window
+            if w[min_values + pos] < smoothed:
+                break
+            min_len -= 1
+        pos = min_head + min_len
+        if pos >= r_window:
+            pos -= r_window
+        w[min_index + pos] = r_count
+        w[min_values + pos] = smoothed
+        min_len += 1
+        while max_len > 0:
+            pos = max_head + max_len - 1
+            if pos >= r_window:
+                pos -= r_window
+            if w[max_values + pos] > smoothed:
+                break
+            max_len -= 1
+        pos = max_head + max_len
+        if pos >= r_window:
+            pos -= r_window
+        w[max_index + pos] = r_count
+        w[max_values + pos] = smoothed
+        max_len += 1
+        r_count += 1
+
+        """ Threshold with hysteresis """
+        if r_count >= r_window:
+            minimum = w[min_values + min_head]
+            signal_range = w[max_values + max_head] - minimum
+            level = (smoothed - minimum) * 100
+            if detected == 0 and level > on_percent * signal_range and (last_beat < 0 or seq - last_beat >= debounce):
+                detected = 1
+                last_beat = seq
+                if found < beats_max:
+                    b[found] = seq
+                    found += 1
+            elif detected != 0 and level < off_percent * signal_range:
+                detected = 0
+        seq += 1
+
+    w[_TOTAL] = total
+    w[_SMOOTH_INDEX] = s_index
+    w[_SMOOTH_COUNT] = s_count
+    w[_RANGE_COUNT] = r_count
+    w[_MIN_HEAD] = min_head
+    w[_MIN_LEN] = min_len
+    w[_MAX_HEAD] = max_head
+    w[_MAX_LEN] = max_len
+    w[_BEAT_DETECTED] = detected
+    w[_LAST_BEAT] = last_beat
+    w[_HISTORY_HEAD] = h_head
+    w[_SEQ] = seq
+    w[_SMOOTHED] = smoothed_count
+    return found
@@ -1,5 +1,6 @@
 from fifo import Fifo
 from machine import Pin, I2C
+import uasyncio as asyncio
 import time
 
 class Encoder:
@@ -11,6 +12,7 @@ class Encoder:
         self.sw1 = Pin(8, Pin.IN, Pin.PULL_UP)
         self.sw2 = Pin(7, Pin.IN, Pin.PULL_UP)
         self.fifo = Fifo(30, typecode='i')
+        self.flag = asyncio.ThreadSafeFlag() #### SET FROM THE IRQS, LETS THE INPUT TASK SLEEP UNTIL SOMETHING HAPPENS
         self.debounce_ms = 150
         self.last_a_time = 0
         self.last_push_time = 0
@@ -34,28 +36,33 @@ class Encoder:
                 self.fifo.put(-1)
             else:
                 self.fifo.put(1)
+            self.flag.set()
             self.last_a_time = now
 
     def push_handler(self, pin):
         now = time.ticks_ms()
         if time.ticks_diff(now, self.last_push_time) > 300:
             self.fifo.put(2)
+            self.flag.set()
             self.last_push_time = now
 
     def sw0_handler(self, pin):
         now = time.ticks_ms()
         if time.ticks_diff(now, self.last_sw0_time) > self.debounce_ms:
             self.fifo.put(3)
+            self.flag.set()
             self.last_sw0_time = now
 
     def sw1_handler(self, pin):
         now = time.ticks_ms()
         if time.ticks_diff(now, self.last_sw1_time) > self.debounce_ms:
             self.fifo.put(4)
+            self.flag.set()
             self.last_sw1_time = now
 
     def sw2_handler(self, pin):
         now = time.ticks_ms()
         if time.ticks_diff(now, self.last_sw2_time) > self.debounce_ms:
             self.fifo.put(5)
+            self.flag.set()
             self.last_sw2_time = now
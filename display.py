@@ -0,0 +1,105 @@
+from machine import Pin, I2C
+from ssd1306 import SSD1306_I2C
+import uasyncio as asyncio
+
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+class Display(SSD1306_I2C):
+    """ The one display driver, shared by every screen. It owns the I2C bus and the framebuffer.
+
+        Screens draw into the framebuffer and call update() instead of show(). The run() task
+        pushes pending frames at no more than `fps` frames per second, and show() only sends
+        the pages (8 pixel rows, `width` bytes each) that changed since the last push """
+    def __init__(self, width=128, height=64, i2c=None, addr=0x3C, fps=30):
+        if i2c is None:
+            i2c = I2C(1, scl=Pin(15), sda=Pin(14), freq=400000)
+        self.frame_ms = 1000 // fps
+        self.pending = asyncio.Event()
+        self.shadow = bytearray(width * height // 8)
+        self.clears = 0
+        self.force = True
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.pages_sent = 0
+        self.bytes_sent = 0
+        super().__init__(width, height, i2c, addr)
+        """ One view per page of the framebuffer and of the shadow, made once so comparing pages allocates nothing """
+        buffer = memoryview(self.buffer)
+        shadow = memoryview(self.shadow)
+        self.buffer_pages = [buffer[page * width:(page + 1) * width] for page in range(self.pages)]
+        self.shadow_pages = [shadow[page * width:(page + 1) * width] for page in range(self.pages)]
+
+    def fill(self, c):
+        """ Counted so incremental screens can tell when something else redrew the display """
+        self.clears += 1
+        super().fill(c)
+
+    def write_cmd(self, cmd):
+        super().write_cmd(cmd)
+        self.bytes_sent += 2
+
+    def send_pages(self, first, last):
+        width = self.width
+        start = first * width
+        end = (last + 1) * width
+        self.write_cmd(SET_COL_ADDR)
+        self.write_cmd(0)
+        self.write_cmd(width - 1)
+        self.write_cmd(SET_PAGE_ADDR)
+        self.write_cmd(first)
+        self.write_cmd(last)
+        data = memoryview(self.buffer)[start:end]
+        self.write_data(data)
+        self.shadow[start:end] = data
+        self.pages_sent += last - first + 1
+        self.bytes_sent += end - start + 1
+
+    def show(self):
+        """ A full compare is a single memcmp, so an unchanged frame costs no bus time at all """
+        if not self.force and self.buffer == self.shadow:
+            self.frames_skipped += 1
+            return
+        if self.force:
+            """ Also the first frame, pushed by the driver's init_display() before the page views exist """
+            self.send_pages(0, self.pages - 1)
+            self.force = False
+            self.frames_sent += 1
+            return
+        buffer_pages = self.buffer_pages
+        shadow_pages = self.shadow_pages
+        first = -1
+        for page in range(self.pages):
+            if buffer_pages[page] != shadow_pages[page]:
+                if first < 0:
+                    first = page
+            elif first >= 0:
+                self.send_pages(first, page - 1)
+                first = -1
+        if first >= 0:
+            self.send_pages(first, self.pages - 1)
+        self.force = False
+        self.frames_sent += 1
+
+    def update(self):
+        """ Ask the render task to push the framebuffer """
+        self.pending.set()
+
+    async def run(self):
+        while True:
+            await self.pending.wait()
+            self.pending.clear()
+            self.show()
+            await asyncio.sleep_ms(self.frame_ms)
+
+    def redraw(self):
+        """ Push the whole framebuffer on the next show(), e.g. after the panel was reset """
+        self.force = True
+
+    def stats(self):
+        return {
+            "frames_sent": self.frames_sent,
+            "frames_skipped": self.frames_skipped,
+            "pages_sent": self.pages_sent,
+            "bytes_sent": self.bytes_sent,
+        }
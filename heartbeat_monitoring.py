@@ -1,43 +1,530 @@
 from machine import ADC, Pin
 from piotimer import Piotimer
-from fifo import Fifo
-import time
+from array import array
+import uasyncio as asyncio
+import beat_kernel
 
-class ADC_Fifo(Fifo):
-    def __init__(self, size, adc_pin):
-        super().__init__(size)
+class ADC_Capture:
+    """ Sample capture for the timer callback that loses nothing while the consumer is late.
+        Samples go into `count` preallocated blocks of `block` samples, all in one array.
+        The callback only fills blocks and the consumer only reads full ones, each advancing its own
+        counter (`filled`, `consumed`), so neither side writes anything the other one writes.
+        `flag` is set for every full block.
+
+        Every sample gets a number from `seq`, counted from reset(), and each block keeps the number of
+        its first sample in `starts`, so the consumer knows when a sample was taken however late it reads it.
+        If all blocks are still unread, new samples are counted in `lost` and skipped. They show up as a jump
+        in the block start numbers, which is what makes HeartbeatMonitor.process() start detection over.
+        `lost` counts from reset(), dropped() from construction, for the diagnostics """
+    def __init__(self, adc_pin, block=10, count=32):
         self.adc = ADC(Pin(adc_pin, Pin.IN))
-    
+        self.block = block
+        self.count = count
+        self.capacity = block * count
+        self.data = array('H', [0] * self.capacity)
+        self.starts = array('i', [0] * count)
+        self.flag = asyncio.ThreadSafeFlag()
+        self.lost = 0
+        self.lost_before = 0
+        self.reset()
+
+    def reset(self, block=None):
+        """ A smaller block suits a lower sample rate, `block` can be anything up to the size given at construction """
+        if block:
+            self.block = block
+            self.capacity = block * self.count
+        self.seq = 0
+        self.pos = 0
+        self.filled = 0
+        self.consumed = 0
+        self.lost_before += self.lost
+        self.lost = 0
+
     def handler(self, tid):
-        self.put(self.adc.read_u16())
+        seq = self.seq
+        self.seq = seq + 1
+        if self.filled - self.consumed >= self.count:
+            self.lost += 1
+            return
+        slot = self.filled % self.count
+        pos = self.pos
+        if pos == 0:
+            self.starts[slot] = seq
+        self.data[slot * self.block + pos] = self.adc.read_u16()
+        pos += 1
+        if pos == self.block:
+            self.pos = 0
+            self.filled += 1
+            self.flag.set()
+        else:
+            self.pos = pos
+
+    def level(self):
+        """ Samples captured but not read yet """
+        return (self.filled - self.consumed) * self.block + self.pos
+
+    def dropped(self):
+        return self.lost_before + self.lost
+
+class SampleBuffer:
+    """ Fixed size ring buffer on top of an array. Index 0 is the oldest sample and -1 the newest,
+        so readers can walk the buffer in order without copying it.
+        `written` counts every append, so a reader can tell how many samples are new since it last looked """
+    def __init__(self, size, typecode):
+        self.size = size
+        self.data = array(typecode, [0] * size)
+        self.head = 0
+        self.count = 0
+        self.written = 0
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.written = 0
+
+    def append(self, value):
+        self.written += 1
+        self.data[self.head] = value
+        self.head += 1
+        if self.head == self.size:
+            self.head = 0
+        if self.count < self.size:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("SampleBuffer index out of range")
+        i += self.head - self.count
+        if i < 0:
+            i += self.size
+        return self.data[i]
+
+class RollingAverage:
+    """ Moving average over the last `window` samples, kept as a ring buffer and a running sum.
+        The average is returned in fixed point as the window sum, i.e. scaled by `window` """
+    def __init__(self, window):
+        self.window = window
+        self.samples = array('H', [0] * window)
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+    def reset(self):
+        for i in range(self.window):
+            self.samples[i] = 0
+        self.index = 0
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        """ Returns the window sum once the window is full, None before that """
+        self.total += value - self.samples[self.index]
+        self.samples[self.index] = value
+        self.index += 1
+        if self.index == self.window:
+            self.index = 0
+        if self.count < self.window:
+            self.count += 1
+            if self.count < self.window:
+                return None
+        return self.total
+
+class Decimator:
+    """ Anti-alias filter and downsampler from the capture rate to the display rate.
+        It is a second order CIC filter, a moving sum of `factor` samples applied twice, which is
+        a triangle of 2 * factor - 1 weights with nulls at every multiple of the output rate.
+        Its integrators start over every output sample, so the sums stay small ints however long
+        it runs: within a block `total` is the plain sum and `falling` weights the samples
+        factor..1, which also gives the rising half 1..factor for the next output.
+        Outputs are divided by the filter's gain of factor squared, so they stay in ADC units
+        whatever the factor, and go to `history` """
+    def __init__(self, factor, history):
+        self.history = history
+        self.set_factor(factor)
+
+    def set_factor(self, factor):
+        self.factor = factor
+        self.gain = factor * factor
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.falling = 0
+        self.rising = -1
+
+    def add_block(self, data, start, count):
+        factor = self.factor
+        n = self.count
+        total = self.total
+        falling = self.falling
+        for i in range(start, start + count):
+            total += data[i]
+            falling += total
+            n += 1
+            if n == factor:
+                if self.rising >= 0:
+                    self.history.append((self.rising + falling - total) // self.gain)
+                self.rising = (factor + 1) * total - falling
+                n = total = falling = 0
+        self.count = n
+        self.total = total
+        self.falling = falling
+
+class SlidingMinMax:
+    """ Min and max of the last `window` values using two monotonic queues.
+        Each queue is a ring of (sample index, value) pairs, so adding a value is amortised O(1) """
+    def __init__(self, window):
+        self.window = window
+        self.min_index = array('i', [0] * window)
+        self.min_values = array('i', [0] * window)
+        self.max_index = array('i', [0] * window)
+        self.max_values = array('i', [0] * window)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.min_head = 0
+        self.min_len = 0
+        self.max_head = 0
+        self.max_len = 0
+
+    def add(self, value):
+        window = self.window
+        index = self.count
+        oldest = index - window
+
+        """ Drop the front entries that fell out of the window """
+        if self.min_len and self.min_index[self.min_head] <= oldest:
+            self.min_head = (self.min_head + 1) % window
+            self.min_len -= 1
+        if self.max_len and self.max_index[self.max_head] <= oldest:
+            self.max_head = (self.max_head + 1) % window
+            self.max_len -= 1
+
+        """ Drop entries from the back that can never be the min/max again """
+        while self.min_len and self.min_values[(self.min_head + self.min_len - 1) % window] >= value:
+            self.min_len -= 1
+        pos = (self.min_head + self.min_len) % window
+        self.min_index[pos] = index
+        self.min_values[pos] = value
+        self.min_len += 1
+
+        while self.max_len and self.max_values[(self.max_head + self.max_len - 1) % window] <= value:
+            self.max_len -= 1
+        pos = (self.max_head + self.max_len) % window
+        self.max_index[pos] = index
+        self.max_values[pos] = value
+        self.max_len += 1
+
+        self.count = index + 1
+
+    def full(self):
+        return self.count >= self.window
+
+    def min(self):
+        return self.min_values[self.min_head]
+
+    def max(self):
+        return self.max_values[self.max_head]
+
+def whole_percent(fraction):
+    """ Detector thresholds are compared in whole percent so the per sample path stays in small ints.
+        A fraction that is not a whole percent, such as 0.625, is refused instead of silently rounded """
+    percent = int(fraction * 100 + 0.5)
+    if abs(percent - fraction * 100) > 1e-6:
+        raise ValueError("threshold %r is not a whole percent" % fraction)
+    return percent
+
+class ThresholdDetector:
+    """ Beat detectors take one raw sample at a time with its sample number and return the
+        number of the sample the beat is timed at, or -1. Each one keeps the signal it wants
+        plotted in `history` and starts over on reset(). HeartbeatMonitor turns beats into intervals.
+        A detector with add_block(data, start, count, seq) is given whole blocks instead and
+        leaves the beats it found in `beats`. Windows are set in ms so they keep their length
+        at any sample rate.
+
+        This one is the original detector: a moving average, and a beat when the average rises
+        above threshold_on of the min-max range of the last threshold_window_ms. It has to fall
+        below threshold_off before the next beat, and beats closer than debounce_ms are ignored.
+        Both thresholds are fractions in whole percent steps, see whole_percent() """
+    def __init__(self, sample_rate, smoothing_ms=75, threshold_window_ms=1250,
+                 threshold_on=0.6, threshold_off=0.4, debounce_ms=300):
+        self.smoother = RollingAverage(smoothing_ms * sample_rate // 1000)
+        self.range_tracker = SlidingMinMax(threshold_window_ms * sample_rate // 1000)
+        """ Smoothed values are window sums (see RollingAverage), which keeps them integer """
+        self.history = SampleBuffer(250, 'i')
+        self.on_percent = whole_percent(threshold_on)
+        self.off_percent = whole_percent(threshold_off)
+        self.debounce_samples = debounce_ms * sample_rate // 1000
+        self.reset()
+
+    def reset(self):
+        self.smoother.reset()
+        self.range_tracker.reset()
+        self.beat_detected = False
+        self.last_beat_seq = -1
+
+    def add(self, value, seq):
+        smoothed_value = self.smoother.add(value)
+        if smoothed_value is None:
+            return -1
+        self.history.append(smoothed_value)
+        self.range_tracker.add(smoothed_value)
+        if not self.range_tracker.full():
+            return -1
+        minimum = self.range_tracker.min()
+        signal_range = self.range_tracker.max() - minimum
+        level = (smoothed_value - minimum) * 100
+        if not self.beat_detected and level > self.on_percent * signal_range and (self.last_beat_seq < 0 or seq - self.last_beat_seq >= self.debounce_samples):
+            self.beat_detected = True
+            self.last_beat_seq = seq
+            return seq
+        if self.beat_detected and level < self.off_percent * signal_range:
+            self.beat_detected = False
+        return -1
+
+class SlopeSumDetector:
+    """ Slope sum function detector (Zong et al., 2003). The sum of the rises of the lightly smoothed
+        signal over the last slope_window_ms is large only on the systolic upstroke, whatever the
+        baseline does, so no min-max window is needed. A beat is where that sum crosses threshold
+        times the typical beat peak, which is learnt over the first learn_ms and then follows each
+        beat as a running average. With no beat for timeout_ms the peak estimate decays, so the
+        detector finds the pulse again after the finger moves """
+    def __init__(self, sample_rate, smoothing_ms=25, slope_window_ms=125, threshold=0.5,
+                 debounce_ms=300, learn_ms=2000, timeout_ms=2000):
+        self.smoother = RollingAverage(smoothing_ms * sample_rate // 1000)
+        self.slope_window = slope_window_ms * sample_rate // 1000
+        self.rises = array('i', [0] * self.slope_window)
+        self.history = SampleBuffer(250, 'i')
+        self.percent = whole_percent(threshold)
+        self.debounce_samples = debounce_ms * sample_rate // 1000
+        self.learn_samples = learn_ms * sample_rate // 1000
+        self.timeout_samples = timeout_ms * sample_rate // 1000
+        self.reset()
+
+    def reset(self):
+        self.smoother.reset()
+        for i in range(self.slope_window):
+            self.rises[i] = 0
+        self.index = 0
+        self.slope_sum = 0
+        self.previous = -1
+        self.count = 0
+        self.peak = 0
+        self.beat_peak = 0
+        self.in_beat = False
+        self.last_beat = 0
+
+    def add(self, value, seq):
+        smoothed = self.smoother.add(value)
+        if smoothed is None:
+            return -1
+        self.history.append(smoothed)
+        rise = smoothed - self.previous if self.previous >= 0 else 0
+        self.previous = smoothed
+        if rise < 0:
+            rise = 0
+        slope_sum = self.slope_sum + rise - self.rises[self.index]
+        self.slope_sum = slope_sum
+        self.rises[self.index] = rise
+        self.index += 1
+        if self.index == self.slope_window:
+            self.index = 0
+        count = self.count + 1
+        self.count = count
+
+        if count <= self.learn_samples:
+            if slope_sum > self.peak:
+                self.peak = slope_sum
+            self.last_beat = count
+            return -1
+        threshold = self.peak * self.percent // 100
+        if self.in_beat:
+            if slope_sum > self.beat_peak:
+                self.beat_peak = slope_sum
+            if slope_sum < threshold:
+                self.in_beat = False
+                self.peak += (self.beat_peak - self.peak) >> 2
+            return -1
+        if slope_sum > threshold and count - self.last_beat >= self.debounce_samples:
+            self.in_beat = True
+            self.beat_peak = slope_sum
+            self.last_beat = count
+            return seq
+        if count - self.last_beat > self.timeout_samples:
+            self.peak -= self.peak >> 8
+        return -1
+
+class PeakDetector:
+    """ Times each beat at the top of the systolic peak, in integer arithmetic only.
+        The signal range is followed by a decaying envelope: a new extreme moves it at once and
+        otherwise each edge creeps towards the other by 1/2**decay_shift of the range per sample,
+        which costs two compares and a shift instead of a min-max window. A peak is the highest
+        value seen since the signal rose above threshold of the range. It is reported once the
+        signal has dropped an eighth of the range below it, so the returned sample number lies
+        a few samples in the past. The signal has to fall back below threshold before the next peak """
+    def __init__(self, sample_rate, smoothing_ms=75, threshold=0.6, debounce_ms=300, decay_shift=7):
+        self.smoother = RollingAverage(smoothing_ms * sample_rate // 1000)
+        self.history = SampleBuffer(250, 'i')
+        self.percent = whole_percent(threshold)
+        self.debounce_samples = debounce_ms * sample_rate // 1000
+        self.decay_shift = decay_shift
+        self.settle_samples = sample_rate
+        self.reset()
+
+    def reset(self):
+        self.smoother.reset()
+        self.high = -1
+        self.low = -1
+        self.count = 0
+        self.candidate = -1
+        self.candidate_seq = -1
+        self.armed = False
+        self.last_beat_seq = -1
+
+    def add(self, value, seq):
+        smoothed = self.smoother.add(value)
+        if smoothed is None:
+            return -1
+        self.history.append(smoothed)
+        if self.high < 0:
+            self.high = self.low = smoothed
+        high = self.high
+        low = self.low
+        decay = (high - low) >> self.decay_shift
+        high = smoothed if smoothed > high else high - decay
+        low = smoothed if smoothed < low else low + decay
+        self.high = high
+        self.low = low
+        self.count += 1
+        if self.count < self.settle_samples:
+            return -1
+
+        signal_range = high - low
+        if self.candidate >= 0:
+            if smoothed > self.candidate:
+                self.candidate = smoothed
+                self.candidate_seq = seq
+            elif (self.candidate - smoothed) * 8 > signal_range:
+                beat = self.candidate_seq
+                self.candidate = -1
+                self.armed = False
+                if self.last_beat_seq < 0 or beat - self.last_beat_seq >= self.debounce_samples:
+                    self.last_beat_seq = beat
+                    return beat
+            return -1
+        above = (smoothed - low) * 100 > self.percent * signal_range
+        if self.armed:
+            if above:
+                self.candidate = smoothed
+                self.candidate_seq = seq
+        elif not above:
+            self.armed = True
+        return -1
+
+class KernelDetector:
+    """ ThresholdDetector with the per sample work done a block at a time by
+        beat_kernel.threshold_block, viper compiled on the device. It plots the same values and
+        finds the same beats, bit for bit, in a fraction of the time. add() is there for callers
+        that feed single samples, HeartbeatMonitor uses add_block() """
+    def __init__(self, sample_rate, smoothing_ms=75, threshold_window_ms=1250,
+                 threshold_on=0.6, threshold_off=0.4, debounce_ms=300, beats_max=4):
+        self.history = SampleBuffer(250, 'i')
+        self.work = beat_kernel.workspace(smoothing_ms * sample_rate // 1000,
+                                          threshold_window_ms * sample_rate // 1000, whole_percent(threshold_on),
+                                          whole_percent(threshold_off), debounce_ms * sample_rate // 1000,
+                                          self.history.size, beats_max)
+        self.beats = array('i', [0] * beats_max)
+        self.one = array('H', [0])
+        self.kernel = beat_kernel.threshold_block
+
+    def reset(self):
+        beat_kernel.reset(self.work)
+
+    def add_block(self, data, start, count, seq):
+        """ Runs data[start:start + count], the first being sample number seq.
+            The found beats are the first entries of `beats`, the return value is how many """
+        work = self.work
+        history = self.history
+        work[beat_kernel.START] = start
+        work[beat_kernel.COUNT] = count
+        work[beat_kernel.SEQ] = seq
+        work[beat_kernel.HISTORY_HEAD] = history.head
+        found = self.kernel(work, data, history.data, self.beats)
+        smoothed = work[beat_kernel.SMOOTHED]
+        history.head = work[beat_kernel.HISTORY_HEAD]
+        history.written += smoothed
+        history.count = min(history.size, history.count + smoothed)
+        return found
+
+    def add(self, value, seq):
+        self.one[0] = value
+        if self.add_block(self.one, 0, 1, seq):
+            return self.beats[0]
+        return -1
+
+DETECTORS = {"threshold": ThresholdDetector, "kernel": KernelDetector, "slope": SlopeSumDetector, "peak": PeakDetector}
 
 class HeartbeatMonitor:
-    def __init__(self, adc_pin, sample_rate):
-        self.fifo = ADC_Fifo(50, adc_pin)
+    def __init__(self, adc_pin, sample_rate, detector=None, preview_rate=None, preview_detector=None, display_rate=50):
+        """ Blocks of 50 ms, at least 10 samples, so the consumer wakes as often at any sample rate """
+        self.capture = ADC_Capture(adc_pin, block=self.block_size(max(sample_rate, preview_rate or 0)))
         self.timer = None
-        self.history = []
-        self.smoothed_history = []
+        """ Any of DETECTORS, the original threshold detector unless told otherwise. start(preview=True)
+            samples at preview_rate instead, with preview_detector, which must be built for that rate """
+        self.full_mode = (sample_rate, detector or ThresholdDetector(sample_rate))
+        self.preview_mode = (preview_rate, preview_detector or ThresholdDetector(preview_rate)) if preview_rate else self.full_mode
+        """ What the PPG plot shows, the raw samples filtered down to about display_rate """
+        self.display_rate = display_rate
+        self.display_history = SampleBuffer(160, 'i')
+        self.decimator = Decimator(1, self.display_history)
+        """ Beat times come from sample numbers, so they are exact however late process() runs.
+            last_beat_time is the same moment in ms since start() """
+        self.next_seq = 0
+        self.last_beat_seq = -1
         self.last_beat_time = 0
-        self.beat_detected = False
         self.intervals = []
         self.report_interval = 5000
-        self.last_report_time = 0
+        self.last_report_seq = 0
         self.latest_bpm = 0
-        self.smoothing_window = 15 
-        self.debounce_time = 300 
         self.is_running = False
-        self.sample_rate = sample_rate
+        self.on_interval = None #### CALLED WITH EVERY ACCEPTED INTERVAL, BEFORE THE BPM REPORT CLEARS THEM
+        self.use(self.full_mode)
+
+    def block_size(self, sample_rate):
+        return max(10, sample_rate // 20)
+
+    def use(self, mode):
+        """ Switches everything that depends on the sample rate to `mode`, a (rate, detector) pair """
+        self.mode = mode
+        self.sample_rate, self.detector = mode
+        self.smoothed_history = self.detector.history
+        self.report_samples = self.report_interval * self.sample_rate // 1000
+        self.decimator.set_factor(max(1, self.sample_rate // self.display_rate))
     
-    def start(self):
+    def start(self, preview=False):
+        """ Preview is enough for the BPM on the HEARTRATE screen, HRV measurements want the full rate
+            for beat timing. Starting in the other mode while running restarts at that mode's rate """
+        mode = self.preview_mode if preview else self.full_mode
+        if self.is_running and mode is not self.mode:
+            self.stop()
         if not self.is_running:
             self.is_running = True
-            self.history = []
-            self.smoothed_history = []
+            self.use(mode)
+            self.smoothed_history.clear()
+            self.display_history.clear()
             self.intervals = []
-            self.last_beat_time = 0
-            self.beat_detected = False
-            self.last_report_time = time.ticks_ms()
-            self.timer = Piotimer(mode=Piotimer.PERIODIC, freq=self.sample_rate, callback=self.fifo.handler)
+            self.resync()
+            self.capture.reset(self.block_size(self.sample_rate))
+            self.next_seq = 0
+            self.last_report_seq = 0
+            self.timer = Piotimer(mode=Piotimer.PERIODIC, freq=self.sample_rate, callback=self.capture.handler)
     
     def stop(self):
         if self.is_running:
@@ -48,43 +535,57 @@ class HeartbeatMonitor:
     
     def get_bpm(self):
         return self.latest_bpm
+
+    def resync(self):
+        """ Start detection over, after start() or when captured samples were lost """
+        self.detector.reset()
+        self.decimator.reset()
+        self.last_beat_seq = -1
     
+    def add_beat(self, beat):
+        """ Turns the beat at sample number `beat` into an interval from the previous one """
+        if self.last_beat_seq >= 0:
+            interval = (beat - self.last_beat_seq) * 1000 // self.sample_rate
+            if 333 <= interval <= 1500:
+                self.intervals.append(interval)
+                if self.on_interval:
+                    self.on_interval(interval)
+        self.last_beat_seq = beat
+        self.last_beat_time = beat * 1000 // self.sample_rate
+
     def process(self):
         if not self.is_running:
             return
         
-        current_time = time.ticks_ms()
-        while not self.fifo.empty():
-            value = self.fifo.get()
-            self.history.append(value)
-            if len(self.history) > 250:
-                self.history.pop(0)
-            """Smooth the values"""
-            if len(self.history) >= self.smoothing_window:
-                smoothed_value = sum(self.history[-self.smoothing_window:]) / self.smoothing_window
-                self.smoothed_history.append(smoothed_value)
-                if len(self.smoothed_history) > 250:
-                    self.smoothed_history.pop(0)
-                """ Apply Threshold """
-                if len(self.smoothed_history) >= 250:
-                    minimum = min(self.smoothed_history)
-                    maximum = max(self.smoothed_history)
-                    signal_range = maximum - minimum
-                    threshold_on = minimum + 0.6 * signal_range
-                    threshold_off = minimum + 0.4 * signal_range
-
-                    """ Check for Heartbeat """
-                    if not self.beat_detected and smoothed_value > threshold_on and time.ticks_diff(current_time, self.last_beat_time) >= self.debounce_time:
-                        self.beat_detected = True
-                        if self.last_beat_time != 0:
-                            interval = time.ticks_diff(current_time, self.last_beat_time)
-                            if 333 <= interval <= 1500:
-                                self.intervals.append(interval)
-                        self.last_beat_time = current_time
-                    elif self.beat_detected and smoothed_value < threshold_off:
-                        self.beat_detected = False
+        capture = self.capture
+        data = capture.data
+        block = capture.block
+        detect = self.detector.add
+        decimate = self.decimator.add_block
+        """ Detectors that have add_block() take a whole block per call """
+        add_block = getattr(self.detector, "add_block", None)
+        beats = getattr(self.detector, "beats", None)
+        while capture.consumed != capture.filled:
+            slot = capture.consumed % capture.count
+            seq = capture.starts[slot]
+            if seq != self.next_seq:
+                self.resync()
+            start = slot * block
+            if add_block:
+                for k in range(add_block(data, start, block, seq)):
+                    self.add_beat(beats[k])
+                seq += block
+            else:
+                for i in range(start, start + block):
+                    beat = detect(data[i], seq)
+                    if beat >= 0:
+                        self.add_beat(beat)
+                    seq += 1
+            decimate(data, start, block)
+            self.next_seq = seq
+            capture.consumed += 1
         """ Calculate the BPM """
-        if time.ticks_diff(current_time, self.last_report_time) >= self.report_interval:
+        if self.next_seq - self.last_report_seq >= self.report_samples:
             if self.intervals:
                 avg_interval = sum(self.intervals) / len(self.intervals)
                 bpm = round(60000 / avg_interval)
@@ -92,4 +593,10 @@ class HeartbeatMonitor:
             else:
                 self.latest_bpm = 0
             self.intervals = []
-            self.last_report_time = current_time
+            self.last_report_seq = self.next_seq
+
+    async def run(self):
+        """ Sampling task, wakes up when the timer has filled a block of samples """
+        while True:
+            await self.capture.flag.wait()
+            self.process()
@@ -1,19 +1,216 @@
 from fifo import Fifo
 import json
-from machine import Pin, I2C
-from ssd1306 import SSD1306_I2C
+import os
+import struct
 import time
 
+class HistoryLog:
+    """ Measurements stored as an append-only log, one JSON record per line.
+        Appending never rewrites earlier records, so its cost does not depend on the history size.
+        A record cut short by a power loss is just an unreadable line that gets skipped.
+
+        Beside the log is an index file with the byte offset of every record as a 4 byte integer,
+        so the record count and any single record can be read without going through the log """
+    def __init__(self, path="history.log", index_path="history.idx", legacy_path="history.json",
+                 max_records=200, cache_size=4):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.index_path = index_path
+        self.legacy_path = legacy_path
+        self.max_records = max_records
+        self.cache_size = cache_size
+        self.cache = {}
+        self.cache_order = []
+        self.offset = bytearray(4)
+        self.migrate()
+        self.recover()
+        self.count = self.file_size(self.index_path) // 4
+        if not self.index_ok():
+            self.rebuild_index()
+
+    def exists(self, path):
+        try:
+            os.stat(path)
+            return True
+        except OSError:
+            return False
+
+    def file_size(self, path):
+        try:
+            return os.stat(path)[6]
+        except OSError:
+            return 0
+
+    def replace(self, src, dst):
+        """ Swap the rewritten file in with a single rename """
+        try:
+            os.rename(src, dst)
+        except OSError:
+            os.remove(dst)
+            os.rename(src, dst)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def migrate(self):
+        """ One time conversion of the old history.json list of records, which go before any in the log.
+            The legacy file is renamed before the merge and removed after it, and a log that already
+            starts with its records is not merged again, so a power loss at any step repeats nothing """
+        migrating = self.legacy_path + ".migrating"
+        if self.exists(self.legacy_path) and not self.exists(migrating):
+            os.rename(self.legacy_path, migrating)
+        if not self.exists(migrating):
+            return
+        try:
+            with open(migrating, "r") as f:
+                content = f.read()
+            records = json.loads(content) if content.strip() else []
+        except ValueError:
+            records = []
+        head = []
+        for record in self.records():
+            if len(head) == len(records):
+                break
+            head.append(record)
+        if head != records:
+            with open(self.tmp_path, "w") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                for record in self.records():
+                    f.write(json.dumps(record) + "\n")
+            self.remove(self.index_path)
+            self.replace(self.tmp_path, self.path)
+        os.remove(migrating)
+
+    def recover(self):
+        """ Terminate a record left half written by a power loss so the next append starts on a new line """
+        size = self.file_size(self.path)
+        if size == 0:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(size - 1)
+            last = f.read(1)
+        if last != b"\n":
+            with open(self.path, "ab") as f:
+                f.write(b"\n")
+
+    def read_offset(self, index_file, i):
+        index_file.seek(i * 4)
+        index_file.readinto(self.offset)
+        return struct.unpack("<I", self.offset)[0]
+
+    def index_ok(self):
+        """ Constant time check that the last indexed record ends exactly at the end of the log.
+            It fails after a power loss between writing a record and its index entry """
+        size = self.file_size(self.path)
+        if self.count == 0:
+            return size == 0
+        with open(self.index_path, "rb") as index_file:
+            offset = self.read_offset(index_file, self.count - 1)
+        if offset >= size:
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            f.readline()
+            return f.tell() == size
+
+    def rebuild_index(self):
+        """ Scan the log once and index every readable record """
+        self.count = 0
+        with open(self.index_path, "wb") as index_file:
+            try:
+                f = open(self.path, "rb")
+            except OSError:
+                return
+            with f:
+                offset = 0
+                while True:
+                    line = f.readline()
+                    if not line:
+                        break
+                    try:
+                        json.loads(line)
+                        index_file.write(struct.pack("<I", offset))
+                        self.count += 1
+                    except ValueError:
+                        pass
+                    offset += len(line)
+
+    def append(self, record):
+        line = json.dumps(record) + "\n"
+        offset = self.file_size(self.path)
+        with open(self.path, "a") as f:
+            f.write(line)
+        with open(self.index_path, "ab") as index_file:
+            index_file.write(struct.pack("<I", offset))
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        """ Decoded record number i, oldest first. Recently read records come from a small LRU cache """
+        if i in self.cache:
+            self.cache_order.remove(i)
+            self.cache_order.append(i)
+            return self.cache[i]
+        with open(self.index_path, "rb") as index_file:
+            offset = self.read_offset(index_file, i)
+        with open(self.path, "r") as f:
+            f.seek(offset)
+            record = json.loads(f.readline())
+        if len(self.cache_order) >= self.cache_size:
+            del self.cache[self.cache_order.pop(0)]
+        self.cache[i] = record
+        self.cache_order.append(i)
+        return record
+
+    def records(self):
+        """ Yields the stored records oldest first, skipping damaged lines """
+        try:
+            f = open(self.path, "r")
+        except OSError:
+            return
+        with f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def compact(self, keep=None):
+        """ Rewrite the log without damaged lines, keeping only the newest `keep` records.
+            The index is removed before the new log is swapped in, so a power loss in between
+            leaves a log without an index, which gets rebuilt on the next start """
+        if keep is None:
+            keep = self.max_records
+        skip = self.count - keep
+        with open(self.tmp_path, "w") as f:
+            for record in self.records():
+                if skip > 0:
+                    skip -= 1
+                    continue
+                f.write(json.dumps(record) + "\n")
+        self.remove(self.index_path)
+        self.replace(self.tmp_path, self.path)
+        self.cache = {}
+        self.cache_order = []
+        self.rebuild_index()
+
 class History:
-    def __init__(self, encoder):
-        self.i2c = I2C(1, scl=Pin(15), sda=Pin(14), freq=400000)
-        self.oled_width = 128
-        self.oled_height = 64
-        self.oled = SSD1306_I2C(self.oled_width, self.oled_height, self.i2c)
+    def __init__(self, display):
+        self.oled = display
+        self.oled_width = display.width
+        self.oled_height = display.height
         self.selected = 0
-        self.enc = encoder
-        self.history = None
+        self.count = 0
         self.data_showing = False
+        self.log = HistoryLog()
 
     def invert_text(self, text, x, y, selected=False):
         if selected:
@@ -23,10 +220,12 @@ class History:
         else:
             self.oled.text(text, x, y, 1)
 
-    def append_metrics_to_history(self, metrics_data):
+    def append_metrics_to_history(self, metrics_data, source=None):
         ### KUBIOS OR HRV ?
-        if isinstance(metrics_data, list):  ######Kubios data
+        if isinstance(metrics_data, list):  ######Kubios data, source SAYS IF THE LOCAL ANALYSIS OR KUBIOS MADE IT
             metrics = metrics_data.copy()
+            if source:
+                metrics.append({"source": source})
         else:  ###### HRV data
             metrics = [
                 {"HR": metrics_data.get("MEAN_HR_BPM", 0)},
@@ -43,50 +242,46 @@ class History:
         )
         metrics.append({"time": formatted})
         
-        history_data = []
-        try:
-            with open("history.json", "r") as f:
-                history_data = json.load(f)
-        except:
-            history_data = []
-     
-        history_data.append(metrics)
-        
-        with open("history.json", "w") as f:
-            json.dump(history_data, f)
+        self.log.append(metrics)
 
     def read_json(self):
-        with open("history.json", "r") as f:
-            content = f.read()
-            if content.strip():
-                self.history = json.loads(content)
-            else:
-                self.history = []
+        """ Only the record count is read up front, records are loaded when they are shown.
+            Retention: drop the oldest records once the log has grown well past the limit """
+        if len(self.log) > self.log.max_records + self.log.max_records // 4:
+            self.log.compact()
+        self.count = len(self.log)
 
     def parse_menu(self):
         self.oled.fill(0)
         self.invert_text("History", 30, 0, True)
         self.invert_text("BACK: SW0", 0, 56, True)
-        if self.history:
+        if self.count:
             window_size = 3
-            start = max(0, min(self.selected - 1, len(self.history) - window_size))
-            end = min(start + window_size, len(self.history))
+            start = max(0, min(self.selected - 1, self.count - window_size))
+            end = min(start + window_size, self.count)
             
             for display_xy, i in enumerate(range(start, end)):
-                self.invert_text(f"{i+1}. Measurement", 1, (display_xy+2) * 10, i == self.selected)
+                self.invert_text(self.label(i), 1, (display_xy+2) * 10, i == self.selected)
             
         else:
             self.oled.text("Empty", 40, 30, 1)
         
-        self.oled.show()
+        self.oled.update()
         
+    def label(self, i):
+        """ Advanced results say whether the local analysis or Kubios made them, one run can leave both """
+        for item in self.log.record(i):
+            if "source" in item:
+                return f"{i+1}. {'Kubios' if item['source'] == 'kubios' else 'Local'} HRV"
+        return f"{i+1}. Measurement"
+
     def show_data(self):
         self.oled.fill(0)
         
-        if not self.history:
+        if not self.count:
             return
         
-        metrics_list = self.history[self.selected]
+        metrics_list = self.log.record(self.selected)
         metrics = {}
         for item in metrics_list:
             metrics.update(item)
@@ -105,35 +300,41 @@ class History:
             self.oled.text(f"SDNN: {metrics.get('SDNN', 0):.1f}", 4, 40, 1)
         else:
             
-            self.oled.text(f"HR: {metrics.get('HR', 0):.1f}", 4, 16, 1)
-            self.oled.text(f"STRESS: {metrics.get('STRESS', 'N/A')}", 4, 24, 1)
-            self.oled.text(f"RMSSD: {metrics.get('RMSSD', 'N/A')}", 4, 32, 1)
-            self.oled.text(f"READNS: {metrics.get('READNS', 'N/A')}", 4, 40, 1)
-            self.oled.text(f"PNS: {metrics.get('PNS', 'N/A')}", 4, 48, 1)
-            self.oled.text(f"SNS: {metrics.get('SNS', 'N/A')}", 4, 56, 1)
+            self.oled.text(f"HR: {metrics.get('HR', 0):.1f}", 4, 8, 1)
+            self.oled.text(f"STRESS: {metrics.get('STRESS', 'N/A')}", 4, 16, 1)
+            self.oled.text(f"RMSSD: {metrics.get('RMSSD', 'N/A')}", 4, 24, 1)
+            self.oled.text(f"READNS: {metrics.get('READNS', 'N/A')}", 4, 32, 1)
+            self.oled.text(f"PNS: {metrics.get('PNS', 'N/A')}", 4, 40, 1)
+            self.oled.text(f"SNS: {metrics.get('SNS', 'N/A')}", 4, 48, 1)
+            lf_hf = metrics.get("LF/HF")
+            self.oled.text(f"LF/HF: {lf_hf:.2f}" if lf_hf is not None else "LF/HF: N/A", 4, 56, 1)
         
-        self.oled.show()
+        self.oled.update()
 
-    def run(self):
+    def open(self):
+        """ Entered from the main menu """
         self.read_json()
+        self.selected = min(self.selected, max(0, self.count - 1))
+        self.data_showing = False
         self.parse_menu()
-        while True:
-            while self.enc.fifo.has_data():
-                fifo = self.enc.fifo.get()
-                if fifo == -1:
-                    if self.selected > 0:
-                        self.selected -= 1
-                        self.parse_menu()
-                elif fifo == 1:
-                    if self.selected < len(self.history) - 1:
-                        self.selected += 1
-                        self.parse_menu()
-                elif fifo == 2:
-                    if not self.data_showing:
-                        self.show_data()
-                        self.data_showing = True
-                    else:
-                        self.parse_menu()
-                        self.data_showing = False
-                elif fifo == 3:
-                    return
\ No newline at end of file
+
+    def handle_input(self, fifo):
+        """ Called by MainMenu for every encoder event while history is open, returns False on exit """
+        if fifo == -1:
+            if self.selected > 0:
+                self.selected -= 1
+                self.parse_menu()
+        elif fifo == 1:
+            if self.selected < self.count - 1:
+                self.selected += 1
+                self.parse_menu()
+        elif fifo == 2:
+            if not self.data_showing:
+                self.show_data()
+                self.data_showing = True
+            else:
+                self.parse_menu()
+                self.data_showing = False
+        elif fifo == 3:
+            return False
+        return True
@@ -0,0 +1,532 @@
+""" Benchmarks for the PPG pipeline, run on a regular Python install:
+
+        python host/bench.py
+        python host/bench.py --seconds 300 --bpm 90 --hrv 60 --noise 400
+
+    Reports samples/sec through HeartbeatMonitor.process, detected beats and intervals
+    against the generator's ground truth, CPU, memory and interval error of every beat
+    detector on synthetic traces and on --trace (scored when --trace-beats gives its true
+    beat times), whether the block kernel matches the threshold detector bit for bit and its
+    cost at sample rates up to 2 kHz, the preview and full rates main.py switches between,
+    frame times for UI.draw_ppg, whether the memory use of the sample path
+    stays flat over the session, the cost of reading
+    a Kubios reply with json.loads against jsonscan, and the time and memory the local
+    LF/HF analysis takes on 30 s and 5 min recordings.
+
+    Exits with status 1 when a check fails, e.g. when the sample path's memory keeps growing.
+"""
+import argparse
+from array import array
+import gc
+import json
+import math
+import random
+import sys
+import time
+
+import sim
+
+clock = sim.install()
+
+from machine import ADC
+from heartbeat_monitoring import HeartbeatMonitor, DETECTORS, ThresholdDetector, KernelDetector
+import beat_kernel
+from ui import UI
+from display import Display
+from ppg import SyntheticPPG, load_trace, load_beats, match_intervals
+from broker import readiness_analysis
+import jsonscan
+from networker import KUBIOS_FIELDS
+from hrv_frequency import HRVFrequency
+
+SAMPLE_RATE = 200
+PLOT_LEVEL_TOLERANCE = 0.05 #### SHARE BY WHICH THE DECIMATED PLOT MAY SHIFT WHEN THE SAMPLE RATE CHANGES
+MEMORY_GROWTH_LIMIT = 1024 #### BYTES THE SAMPLE PATH MAY GAIN OVER A SESSION, A FEW INTERVAL INTS AT MOST
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def trace_source(args, seed_offset=0):
+    if args.trace:
+        samples = load_trace(args.trace)
+        position = [0]
+
+        def read():
+            value = samples[position[0] % len(samples)]
+            position[0] += 1
+            return value
+        return read, None
+    ppg = SyntheticPPG(bpm=args.bpm, hrv_ms=args.hrv, noise=args.noise, wander=args.wander,
+                       sample_rate=SAMPLE_RATE, seed=args.seed + seed_offset)
+    return ppg.read, ppg
+
+
+def new_monitor(source, detector=None):
+    clock.reset()
+    ADC.source = staticmethod(source)
+    monitor = HeartbeatMonitor(26, SAMPLE_RATE, detector)
+    monitor.start()
+    return monitor
+
+
+def bench_throughput(args):
+    """ Fill the FIFO with a block of samples and time only the process() call """
+    source, _ = trace_source(args)
+    monitor = new_monitor(source)
+    block = 40
+    elapsed = 0.0
+    processed = 0
+    for _ in range(args.seconds * SAMPLE_RATE // block):
+        clock.advance(block * 1000 // SAMPLE_RATE)
+        start = time.perf_counter()
+        monitor.process()
+        elapsed += time.perf_counter() - start
+        processed += block
+    monitor.stop()
+    return processed / elapsed, elapsed / processed * 1e6
+
+
+def bench_accuracy(args, drain_ms=50, stall_ms=0):
+    """ Beats are timed by sample number, so draining late must not change the result
+        until the capture overruns. `stall_ms` adds one stall halfway through the run.
+        Returns the beat count, the match against ground truth and the samples the capture lost """
+    source, ppg = trace_source(args)
+    period_us = 1000000 // SAMPLE_RATE
+    position = [0, 0]
+    started_us = [0]
+
+    def by_clock():
+        """ The sensor signal goes on while the capture skips samples, so read by time, not by call """
+        due = (clock.now_us - started_us[0]) // period_us
+        while position[0] < due:
+            position[1] = source()
+            position[0] += 1
+        return position[1]
+    monitor = new_monitor(by_clock)
+    started_us[0] = clock.now_us
+    beat_times = []
+
+    def record(interval):
+        beat_times.append(monitor.last_beat_time)
+    monitor.on_interval = record
+    drains = args.seconds * 1000 // drain_ms
+    for i in range(drains):
+        if stall_ms and i == drains // 2:
+            for _ in range(stall_ms // 100):
+                clock.advance(100)
+        clock.advance(drain_ms)
+        monitor.process()
+    lost = monitor.capture.lost
+    monitor.stop()
+    if ppg is None:
+        return len(beat_times), None, lost
+    return len(beat_times), match_intervals(beat_times, ppg.beat_times_ms), lost
+
+
+def detector_memory(name):
+    """ Bytes a detector allocates when it is built, its buffers included """
+    gc.collect()
+    if sys.implementation.name == "micropython":
+        free = gc.mem_free()
+        detector = DETECTORS[name](SAMPLE_RATE)
+        gc.collect()
+        return free - gc.mem_free()
+    import tracemalloc
+    tracemalloc.start()
+    detector = DETECTORS[name](SAMPLE_RATE)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def detector_run(name, samples):
+    """ Feeds recorded samples through HeartbeatMonitor with the named detector in 50 ms blocks.
+        Returns the beat times in ms and the time process() took per sample in microseconds """
+    position = [0]
+
+    def replay():
+        value = samples[position[0]]
+        position[0] += 1
+        return value
+    monitor = new_monitor(replay, DETECTORS[name](SAMPLE_RATE))
+    beat_times = []
+
+    def record(interval):
+        beat_times.append(monitor.last_beat_time)
+    monitor.on_interval = record
+    elapsed = 0.0
+    block = SAMPLE_RATE // 20
+    for _ in range(len(samples) // block):
+        clock.advance(block * 1000 // SAMPLE_RATE)
+        start = time.perf_counter()
+        monitor.process()
+        elapsed += time.perf_counter() - start
+    monitor.stop()
+    return beat_times, elapsed / (len(samples) // block * block) * 1e6
+
+
+def detector_traces(args):
+    """ (name, samples, true beat times or None) for each trace the detectors are compared on """
+    count = args.seconds * SAMPLE_RATE
+    traces = []
+    if args.trace:
+        truth = load_beats(args.trace_beats) if args.trace_beats else None
+        traces.append(("recorded", load_trace(args.trace), truth))
+    for label, bpm, noise, wander in (("synthetic", args.bpm, args.noise, args.wander),
+                                      ("noisy", args.bpm, args.noise * 4, args.wander),
+                                      ("wander", args.bpm, args.noise, args.wander * 3),
+                                      ("fast", 120, args.noise, args.wander)):
+        ppg = SyntheticPPG(bpm=bpm, hrv_ms=args.hrv, noise=noise, wander=wander,
+                           sample_rate=SAMPLE_RATE, seed=args.seed)
+        traces.append((label, ppg.samples(count), ppg.beat_times_ms))
+    return traces
+
+
+def bench_detectors(args):
+    """ Every detector over every trace: CPU per sample through process(), the memory the detector
+        holds, and the intervals against ground truth where there is one """
+    results = []
+    traces = detector_traces(args)
+    for name in DETECTORS:
+        memory = detector_memory(name)
+        for label, samples, truth in traces:
+            beat_times, per_sample_us = detector_run(name, samples)
+            match = match_intervals(beat_times, truth) if truth else None
+            results.append((name, label, memory, per_sample_us, len(beat_times), match))
+    return results
+
+
+def detector_outputs(detector, samples, block=10):
+    """ Every value the detector plots and every beat it finds, fed directly in blocks """
+    data = array('H', samples)
+    history = detector.history
+    plotted = []
+    beats = []
+    for start in range(0, len(samples) - block + 1, block):
+        written = history.written
+        if hasattr(detector, "add_block"):
+            for k in range(detector.add_block(data, start, block, start)):
+                beats.append(detector.beats[k])
+        else:
+            for i in range(start, start + block):
+                beat = detector.add(data[i], i)
+                if beat >= 0:
+                    beats.append(beat)
+        for i in range(history.written - written, 0, -1):
+            plotted.append(history[-i])
+    return plotted, beats
+
+
+def bench_kernel(args):
+    """ The block kernel against ThresholdDetector: whether the pure Python build, the viper
+        source (run as Python through host/micropython.py) and the original detector agree on
+        every plotted value and beat, and what process() costs per second of signal at higher
+        sample rates. Returns (identical, rows) with a row per (rate, detector) """
+    identical = True
+    for noise, wander in ((args.noise, args.wander), (args.noise * 4, args.wander * 3)):
+        ppg = SyntheticPPG(bpm=args.bpm, hrv_ms=args.hrv, noise=noise, wander=wander,
+                           sample_rate=SAMPLE_RATE, seed=args.seed)
+        samples = ppg.samples(args.seconds * SAMPLE_RATE)
+        expected = detector_outputs(ThresholdDetector(SAMPLE_RATE), samples)
+        for kernel in (beat_kernel.python_threshold_block, beat_kernel.threshold_block):
+            detector = KernelDetector(SAMPLE_RATE)
+            detector.kernel = kernel
+            identical = identical and detector_outputs(detector, samples) == expected
+
+    rows = []
+    seconds = min(args.seconds, 10)
+    for rate in (200, 500, 1000, 2000):
+        ppg = SyntheticPPG(bpm=args.bpm, hrv_ms=args.hrv, noise=args.noise, wander=args.wander,
+                           sample_rate=rate, seed=args.seed)
+        samples = ppg.samples(seconds * rate)
+        for name, kernel in (("threshold", None), ("kernel", beat_kernel.python_threshold_block)):
+            position = [0]
+
+            def replay():
+                value = samples[position[0]]
+                position[0] += 1
+                return value
+            clock.reset()
+            ADC.source = staticmethod(replay)
+            if kernel is None:
+                detector = ThresholdDetector(rate)
+            else:
+                detector = KernelDetector(rate)
+                detector.kernel = kernel
+            monitor = HeartbeatMonitor(26, rate, detector)
+            beat_times = []
+            monitor.on_interval = lambda interval: beat_times.append(monitor.last_beat_time)
+            monitor.start()
+            elapsed = 0.0
+            for _ in range(seconds * 20):
+                clock.advance(50)
+                start = time.perf_counter()
+                monitor.process()
+                elapsed += time.perf_counter() - start
+            monitor.stop()
+            match = match_intervals(beat_times, ppg.beat_times_ms)
+            rows.append((rate, name, elapsed / seconds * 1000, monitor.capture.lost, match))
+    return identical, rows
+
+
+def bench_rates(args, sample_rate=250, preview_rate=100):
+    """ The monitor as main.py builds it, in preview and in full mode, against one fixed rate.
+        The synthetic signal is generated at 1 kHz and read by clock time, so the same pulse is
+        sampled at whatever rate the monitor switches to. Returns a row per mode, with the mean
+        level of the plot, and whether start() moved a running preview, on its own detector,
+        to the full rate """
+    ppg = SyntheticPPG(bpm=args.bpm, hrv_ms=args.hrv, noise=args.noise, wander=args.wander,
+                       sample_rate=1000, seed=args.seed)
+    seconds = min(args.seconds, 30)
+    signal = ppg.samples((seconds + 2) * 1000)
+    started_us = [0]
+
+    def by_clock():
+        return signal[(clock.now_us - started_us[0]) // 1000]
+    rows = []
+    for label, rate, preview in (("preview", preview_rate, True), ("full", sample_rate, False),
+                                 ("fixed", SAMPLE_RATE, False)):
+        clock.reset()
+        ADC.source = staticmethod(by_clock)
+        if label == "fixed":
+            monitor = HeartbeatMonitor(26, rate, KernelDetector(rate))
+        else:
+            monitor = HeartbeatMonitor(26, sample_rate, KernelDetector(sample_rate),
+                                       preview_rate, KernelDetector(preview_rate))
+        beat_times = []
+        monitor.on_interval = lambda interval: beat_times.append(monitor.last_beat_time)
+        started_us[0] = clock.now_us
+        monitor.start(preview)
+        elapsed = 0.0
+        for _ in range(seconds * 20):
+            clock.advance(50)
+            start = time.perf_counter()
+            monitor.process()
+            elapsed += time.perf_counter() - start
+        plotted = monitor.display_history.written
+        history = monitor.display_history
+        level = sum(history[i] for i in range(len(history))) / max(1, len(history))
+        monitor.stop()
+        match = match_intervals(beat_times, ppg.beat_times_ms)
+        rows.append((label, monitor.sample_rate, elapsed / seconds * 1000, plotted / seconds, level, match))
+
+    clock.reset()
+    preview = KernelDetector(preview_rate, smoothing_ms=50)
+    monitor = HeartbeatMonitor(26, sample_rate, KernelDetector(sample_rate), preview_rate, preview)
+    monitor.start(preview=True)
+    preview_ok = (monitor.sample_rate == preview_rate and monitor.timer.period_us == 1000000 // preview_rate
+                  and monitor.detector is preview)
+    monitor.start()
+    switched = preview_ok and monitor.sample_rate == sample_rate and monitor.timer.period_us == 1000000 // sample_rate
+    monitor.stop()
+    return rows, switched
+
+
+def bench_draw_ppg(args):
+    source, _ = trace_source(args)
+    monitor = new_monitor(source)
+    display = Display()
+    ui = UI(["HEARTRATE"], 0, 0, display)
+    clock.advance(3000)
+    monitor.process()
+    times = []
+    bus_start = display.i2c.bus_time_us
+    for _ in range(args.frames):
+        clock.advance(50)
+        monitor.process()
+        start = time.perf_counter()
+        ui.draw_ppg(monitor.display_history, 72)
+        display.show()
+        times.append((time.perf_counter() - start) * 1000)
+    monitor.stop()
+    bus_ms = (display.i2c.bus_time_us - bus_start) / 1000 / args.frames
+    return times, bus_ms
+
+
+def bench_memory(args):
+    """ Net allocation of the sample path between 10 s and the end of the session.
+        Uses gc.mem_free() when run under MicroPython's unix port, tracemalloc otherwise """
+    source, _ = trace_source(args)
+    samples = [source() for _ in range(args.seconds * SAMPLE_RATE)]
+    position = [0]
+
+    def replay():
+        value = samples[position[0]]
+        position[0] += 1
+        return value
+    monitor = new_monitor(replay)
+    if sys.implementation.name == "micropython":
+        def used():
+            gc.collect()
+            return -gc.mem_free()
+    else:
+        import tracemalloc
+        tracemalloc.start()
+
+        def used():
+            gc.collect()
+            return tracemalloc.get_traced_memory()[0]
+    first = low = high = None
+    for second in range(args.seconds):
+        for _ in range(SAMPLE_RATE // 10):
+            clock.advance(10 * 1000 // SAMPLE_RATE)
+            monitor.process()
+        if second >= min(10, args.seconds // 2):
+            current = used()
+            if first is None:
+                first = low = high = current
+            low = min(low, current)
+            high = max(high, current)
+    monitor.stop()
+    if sys.implementation.name != "micropython":
+        tracemalloc.stop()
+    return first, current, high - low
+
+
+def bench_kubios_parse(args, repeat=20):
+    """ Time and peak allocation for decoding a detailed Kubios reply, whole and field by field """
+    import tracemalloc
+    rng = random.Random(args.seed)
+    intervals = [round(60000 / args.bpm + rng.gauss(0, args.hrv)) for _ in range(300)]
+    reply = {"id": "1", "type": "readiness", "data": {"status": "ok", "analysis": readiness_analysis(intervals, True)}}
+    payload = json.dumps(reply).encode()
+    results = {}
+    for name, parse in (("json.loads", json.loads), ("jsonscan", lambda msg: jsonscan.extract(msg, KUBIOS_FIELDS))):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parse(payload)
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        gc.collect()
+        tracemalloc.start()
+        parse(payload)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = (elapsed, peak)
+    return len(payload), results
+
+
+def modulated_intervals(seconds, args, lf_ms=40, hf_ms=25):
+    """ RR intervals with a 0.1 Hz and a 0.25 Hz rhythm on top of the generator's beat to beat noise """
+    rng = random.Random(args.seed)
+    intervals = []
+    t = 0
+    while t < seconds * 1000:
+        rr = round(60000 / args.bpm + lf_ms * math.sin(2 * math.pi * 0.1 * t / 1000)
+                   + hf_ms * math.sin(2 * math.pi * 0.25 * t / 1000) + rng.gauss(0, args.hrv / 4))
+        intervals.append(rr)
+        t += rr
+    return intervals
+
+
+def bench_frequency(args, repeat=5):
+    """ HRVFrequency.analyse time and allocations, after the engine's own buffers exist """
+    import tracemalloc
+    tracemalloc.start()
+    engine = HRVFrequency()
+    buffers = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    results = []
+    for seconds in (30, 300):
+        intervals = modulated_intervals(seconds, args)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            engine.analyse(intervals)
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        gc.collect()
+        tracemalloc.start()
+        reply = engine.analyse(intervals)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((seconds, len(intervals), elapsed, peak, reply["data"]["analysis"]["freq_domain"]))
+    return buffers, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--bpm", type=float, default=72)
+    parser.add_argument("--hrv", type=float, default=40)
+    parser.add_argument("--noise", type=float, default=150)
+    parser.add_argument("--wander", type=float, default=1500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--trace", help="recorded trace, one ADC value per line")
+    parser.add_argument("--trace-beats", help="true beat times of the recorded trace, one time in ms per line")
+    args = parser.parse_args()
+    failures = []
+
+    rate, per_sample_us = bench_throughput(args)
+    print(f"process():   {rate:,.0f} samples/s ({per_sample_us:.1f} us/sample, realtime needs {SAMPLE_RATE})")
+
+    for drain_ms, stall_ms in ((50, 0), (1500, 0), (50, 3000)):
+        count, result, lost = bench_accuracy(args, drain_ms, stall_ms)
+        stall = f", one {stall_ms} ms stall" if stall_ms else ""
+        print(f"drained every {drain_ms} ms{stall}: {lost} samples lost")
+        if result is None:
+            print(f"beats:       {count} detected (no ground truth for recorded traces)")
+        else:
+            mae = "n/a" if result["mae_ms"] is None else f"{result['mae_ms']:.1f} ms"
+            worst = "n/a" if result["max_ms"] is None else f"{result['max_ms']:.0f} ms"
+            print(f"beats:       {count} detected, {result['matched']} matched, {result['missed']} missed, {result['extra']} extra")
+            print(f"intervals:   mean abs error {mae}, max {worst}")
+
+    print("detectors:   us/sample, bytes held, beats, intervals against ground truth")
+    for name, label, memory, per_sample_us, count, match in bench_detectors(args):
+        line = f"  {name:<10}{label:<10} {per_sample_us:5.1f} us {memory:6,} B {count:4} beats"
+        if match is not None:
+            mae = "n/a" if match["mae_ms"] is None else f"{match['mae_ms']:.1f} ms"
+            worst = "n/a" if match["max_ms"] is None else f"{match['max_ms']:.0f} ms"
+            line += f", {match['missed']} missed, {match['extra']} extra, error {mae} mean, {worst} max"
+        print(line)
+
+    identical, rows = bench_kernel(args)
+    print(f"kernel:      {'bit-identical' if identical else 'DIFFERENT'} to ThresholdDetector, "
+          f"{'viper source run as Python' if beat_kernel.threshold_block is not beat_kernel.python_threshold_block else 'pure Python build'}")
+    if not identical:
+        failures.append("the beat kernel's values or beats differ from ThresholdDetector")
+    for rate, name, ms_per_s, lost, match in rows:
+        mae = "n/a" if match["mae_ms"] is None else f"{match['mae_ms']:.1f} ms"
+        print(f"  {rate:>5} Hz {name:<10} {ms_per_s:6.1f} ms CPU per second of signal, {lost} lost, "
+              f"{match['missed']} missed, error {mae}")
+
+    rows, switched = bench_rates(args)
+    print(f"rates:       start() {'switches' if switched else 'DOES NOT switch'} a running preview to the full rate")
+    if not switched:
+        failures.append("start() did not run the preview on its own detector and then switch to the full rate")
+    for label, rate, ms_per_s, plotted, level, match in rows:
+        mae = "n/a" if match["mae_ms"] is None else f"{match['mae_ms']:.1f} ms"
+        print(f"  {label:<8}{rate:>4} Hz {ms_per_s:5.1f} ms CPU per second, {plotted:.0f} points/s plotted "
+              f"at level {level:.0f}, {match['missed']} missed, {match['extra']} extra, error {mae}")
+    levels = [level for _, _, _, _, level, _ in rows]
+    if max(levels) > min(levels) * (1 + PLOT_LEVEL_TOLERANCE):
+        failures.append(f"the plot level moves from {min(levels):.0f} to {max(levels):.0f} between sample rates")
+
+    times, bus_ms = bench_draw_ppg(args)
+    print(f"draw_ppg():  median {percentile(times, 50):.2f} ms, p95 {percentile(times, 95):.2f} ms, "
+          f"I2C {bus_ms:.1f} ms/frame at 400 kHz")
+
+    first, last, spread = bench_memory(args)
+    print(f"memory:      {first} -> {last} bytes in use from {min(10, args.seconds // 2)} s to {args.seconds} s (spread {spread})")
+    if last - first > MEMORY_GROWTH_LIMIT:
+        failures.append(f"memory grew by {last - first} bytes, more than {MEMORY_GROWTH_LIMIT}")
+
+    size, results = bench_kubios_parse(args)
+    for name, (elapsed, peak) in results.items():
+        print(f"{name + ':':<12} {size:,} byte Kubios reply in {elapsed:.2f} ms, peak {peak:,} bytes allocated")
+
+    buffers, results = bench_frequency(args)
+    print(f"lf/hf:       {buffers:,} bytes of buffers allocated once")
+    for seconds, count, elapsed, peak, bands in results:
+        print(f"{f'  {seconds} s:':<12} {count} intervals in {elapsed:.1f} ms, peak {peak:,} bytes allocated, "
+              f"LF {bands['LF_power']:.0f} HF {bands['HF_power']:.0f} ms^2, LF/HF {bands['LF_HF_power']:.2f}")
+
+    for failure in failures:
+        print(f"FAIL:        {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+""" Network checks against the local broker stand-in:
+
+        python host/bench_network.py [--scenario responsiveness|reconnect|kubios|stream|load]
+
+    responsiveness  runs an ADVANCED HRV measurement through MainMenu with a slow Kubios reply and
+                    reports when the local results appear, when Kubios replaces them and what each one saves
+    reconnect       drops the broker connection under a live session and reports how long the
+                    session takes to come back and whether its subscriptions still work
+    kubios          sends several Kubios requests at once with replies arriving out of order,
+                    one of them too late, then resends known intervals to hit the cache
+    stream          runs an HRV ANALYSIS measurement with live RR streaming and checks the batches
+                    the broker received against the intervals the device collected
+    load            drives Network.send_kubios, send_hrv_data and send_kubios_data through the
+                    broker and reports round-trip percentiles, messages/sec and timeouts
+
+        python host/bench_network.py --scenario load --requests 200 --concurrency 8 --drop 0.05
+
+    responsiveness and load exit with status 1 and a FAIL line when a check below regresses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sim
+
+clock = sim.install()
+
+from machine import ADC
+from display import Display
+from ppg import SyntheticPPG
+from broker import Broker, KubiosResponder
+from networker import Network
+import main
+
+LOCAL_RESULTS_LIMIT_MS = 500 #### LONGEST WAIT FROM THE END OF A MEASUREMENT TO ITS LOCAL RESULTS ON SCREEN
+STALL_LIMIT_MS = 100 #### LONGEST THE EVENT LOOP MAY BE HELD UP WHILE KUBIOS IS PENDING
+
+
+async def press(menu, *steps):
+    """ steps are 1/-1 for turns and 2 for a push """
+    for step in steps:
+        if step == 2:
+            menu.enc.push.fire()
+        else:
+            menu.enc.b.value(0 if step > 0 else 1)
+            menu.enc.a.fire()
+        await asyncio.sleep(0.35)
+
+
+async def stalls(longest, period=0.01):
+    """ Keeps longest[0] at the largest delay past period seen by a task that only sleeps """
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(period)
+        longest[0] = max(longest[0], time.monotonic() - start - period)
+
+
+async def responsiveness(args):
+    broker = await Broker(port=21883).start()
+    KubiosResponder(broker, latency_ms=args.latency)
+    ADC.source = staticmethod(SyntheticPPG(sample_rate=main.SAMPLE_RATE, seed=args.seed).read)
+    sources = []
+    broker.on("hr-data", lambda topic, payload: sources.append(json.loads(payload).get("source")))
+
+    frame_times = []
+    show = Display.show
+
+    def timed_show(display):
+        frame_times.append(time.monotonic())
+        show(display)
+    Display.show = timed_show
+
+    menu = main.MainMenu()
+    menu.network.broker_ip = "127.0.0.1"
+    menu.hrv_monitor.collection_duration = args.collect * 1000
+    clock_task = asyncio.create_task(clock.run_realtime())
+    menu_task = asyncio.create_task(menu.run())
+    await asyncio.sleep(0.2)
+
+    await press(menu, 1, 1, 2, 2)
+    while not menu.monitor.is_running:
+        await asyncio.sleep(0.005)
+    while menu.monitor.is_running:
+        await asyncio.sleep(0.005)
+    collected = time.monotonic()
+    while menu.current_menu != "kubios_results":
+        await asyncio.sleep(0.005)
+    shown = time.monotonic()
+    saved_locally = len(menu.history.log)
+    frames_before = len(frame_times)
+    longest = [0]
+    stall_task = asyncio.create_task(stalls(longest))
+    deadline = shown + args.latency / 1000 + 15
+    while menu.kubios_source != "KUBIOS" and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+    replaced = time.monotonic()
+    stall_task.cancel()
+    await asyncio.sleep(0.1)
+
+    failures = []
+    local_ms = (shown - collected) * 1000
+    print(f"local:       results on screen {local_ms:.0f} ms after the measurement ended")
+    if local_ms > LOCAL_RESULTS_LIMIT_MS:
+        failures.append(f"local results took {local_ms:.0f} ms, more than {LOCAL_RESULTS_LIMIT_MS}")
+    stall_ms = longest[0] * 1000
+    if menu.kubios_source == "KUBIOS":
+        print(f"kubios:      replaced them {(replaced - shown) * 1000:.0f} ms later, "
+              f"{len(frame_times) - frames_before} frame(s) pushed meanwhile, longest stall {stall_ms:.0f} ms")
+    else:
+        print("kubios:      no reply, the local results stay")
+        failures.append("the Kubios reply never replaced the local results")
+    if stall_ms > STALL_LIMIT_MS:
+        failures.append(f"the event loop stalled for {stall_ms:.0f} ms while Kubios was pending")
+    records = [menu.history.log.record(i) for i in range(len(menu.history.log))]
+    record_sources = [item["source"] for record in records for item in record if "source" in item]
+    print(f"history:     {saved_locally} record(s) with the local results on screen, "
+          f"{len(records)} in the end from {record_sources}, last one {records[-1] if records else None}")
+    print(f"hr-data:     {len(sources)} result(s) published from {sources}")
+    if not saved_locally:
+        failures.append("the local results were not saved to history when they were shown")
+    if len(record_sources) != len(records) or None in sources:
+        failures.append("a saved or published result does not say whether it came from the device or Kubios")
+
+    Display.show = show
+    menu_task.cancel()
+    clock_task.cancel()
+    await broker.stop()
+    return failures
+
+
+METRICS = {"MEAN_HR_BPM": 70, "MEAN_PPI_MS": 857, "RMSSD_MS": 40, "SDNN_MS": 50}
+
+
+async def reconnect(args):
+    broker = await Broker(port=0).start()
+    KubiosResponder(broker, latency_ms=50)
+    network = Network("ssid", "password", "127.0.0.1", port=broker.port)
+    network.min_backoff_ms = 200
+    clock_task = asyncio.create_task(clock.run_realtime())
+
+    # Measurements finished before the first connection wait in the outbox
+    for _ in range(3):
+        network.send_hrv_data(METRICS, "hr-data")
+    network_task = asyncio.create_task(network.run())
+    await network.wait_connected()
+    await asyncio.sleep(0.05)
+    print(f"offline:     3 queued before connecting, {broker.received} delivered after")
+    first = await network.send_kubios(1, [800, 810, 790])
+
+    broker.drop_connections()
+    start = time.monotonic()
+    await asyncio.sleep(0)
+    before = broker.received
+    for _ in range(2):
+        network.send_hrv_data(METRICS, "hr-data")
+    while network.sessions < 2:
+        await asyncio.sleep(0.005)
+    print(f"reconnect:   session back after {(time.monotonic() - start) * 1000:.0f} ms")
+    second = await network.send_kubios(2, [805, 815, 795])
+    print(f"outage:      2 queued while down, {broker.received - before - 1} delivered after reconnect")
+    print(f"kubios:      reply before drop {'ok' if first else 'missing'}, after reconnect {'ok' if second else 'missing'}")
+    print(f"outbox:      {network.outbox.stats()}")
+
+    network_task.cancel()
+    clock_task.cancel()
+    network.drop_connection()
+    await broker.stop()
+
+
+class ShuffledResponder(KubiosResponder):
+    """ Answers each request id after its own delay """
+    def __init__(self, broker, delays):
+        super().__init__(broker)
+        self.delays = delays
+
+    async def respond(self, request):
+        self.latency_ms = self.delays[request["id"]]
+        await super().respond(request)
+
+
+async def kubios(args):
+    broker = await Broker(port=0).start()
+    ShuffledResponder(broker, {"1": 600, "2": 100, "3": 300, "4": 1500})
+    network = Network("ssid", "password", "127.0.0.1", port=broker.port)
+    clock_task = asyncio.create_task(clock.run_realtime())
+    network_task = asyncio.create_task(network.run())
+    await network.wait_connected()
+
+    recordings = {id: [800 + id * 10 + i % 7 for i in range(40)] for id in range(1, 5)}
+    replies = await asyncio.gather(
+        *(network.send_kubios(id, recordings[id], timeout=1 if id == 4 else 10) for id in recordings))
+    matched = sum(1 for id, reply in zip(recordings, replies) if reply and reply["id"] == str(id))
+    print(f"in flight:   {len(recordings)} requests, {matched} answered with their own id, "
+          f"{sum(reply is None for reply in replies)} timed out")
+    await asyncio.sleep(0.7)
+    print(f"late:        {network.kubios.stale} reply ignored after its request timed out")
+
+    start = time.monotonic()
+    again = await network.send_kubios(5, recordings[2])
+    print(f"cache:       resend answered in {(time.monotonic() - start) * 1000:.1f} ms, "
+          f"{'same' if again is replies[1] else 'different'} analysis")
+
+    network_task.cancel()
+    clock_task.cancel()
+    network.drop_connection()
+    await broker.stop()
+
+
+async def stream(args):
+    broker = await Broker(port=21883).start()
+    ADC.source = staticmethod(SyntheticPPG(sample_rate=main.SAMPLE_RATE, seed=args.seed).read)
+    main.RR_STREAM_TOPIC = "hr-rr"
+    menu = main.MainMenu()
+    menu.network.broker_ip = "127.0.0.1"
+    menu.hrv_monitor.collection_duration = args.collect * 1000
+
+    detected = []
+    add = menu.rr_stream.add
+
+    def timed_add(interval):
+        detected.append(time.monotonic())
+        add(interval)
+    menu.rr_stream.add = timed_add
+    batches = []
+    broker.on("hr-rr", lambda topic, payload: batches.append((time.monotonic(), json.loads(payload))))
+
+    clock_task = asyncio.create_task(clock.run_realtime())
+    menu_task = asyncio.create_task(menu.run())
+    await menu.network.wait_connected()
+    await press(menu, 1, 2, 2)
+    while menu.current_menu != "hrv_results":
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+
+    streamed = [rr for _, batch in batches for rr in batch["rr"]]
+    seqs = [batch["seq"] for _, batch in batches]
+    arrivals = [arrived for arrived, batch in batches for _ in batch["rr"]]
+    delays = [(arrived - seen) * 1000 for arrived, seen in zip(arrivals, detected)]
+    print(f"batches:     {len(batches)} for {len(streamed)} intervals, sequence "
+          f"{'complete' if seqs == list(range(len(seqs))) else 'has gaps'}, last flagged {batches[-1][1]['last']}")
+    print(f"intervals:   {'match' if streamed == menu.hrv_monitor.intervals else 'differ from'} the "
+          f"{len(menu.hrv_monitor.intervals)} the device collected")
+    print(f"latency:     detection to broker max {max(delays):.0f} ms, mean {sum(delays) / len(delays):.0f} ms "
+          f"(batch of {menu.rr_stream.batch_size} or {menu.rr_stream.max_latency_ms} ms)")
+
+    menu_task.cancel()
+    clock_task.cancel()
+    menu.network.drop_connection()
+    await broker.stop()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def load(args):
+    broker = await Broker(port=0).start()
+    responder = KubiosResponder(broker, latency_ms=args.latency, jitter_ms=args.jitter, drop_rate=args.drop,
+                                response_size=args.size, seed=args.seed)
+    network = Network("ssid", "password", "127.0.0.1", port=broker.port)
+    clock_task = asyncio.create_task(clock.run_realtime())
+    network_task = asyncio.create_task(network.run())
+    await network.wait_connected()
+    rng = random.Random(args.seed)
+
+    #### KUBIOS ROUND-TRIPS, args.concurrency IN FLIGHT AT A TIME, EACH WITH ITS OWN INTERVALS
+    ids = iter(range(1, args.requests + 1))
+    round_trips, timeouts, replies = [], [], []
+
+    async def worker():
+        for id in ids:
+            intervals = [rng.randint(600, 1100) for _ in range(40)]
+            start = time.monotonic()
+            reply = await network.send_kubios(id, intervals, timeout=args.timeout)
+            elapsed = (time.monotonic() - start) * 1000
+            if reply is None:
+                timeouts.append(elapsed)
+            else:
+                round_trips.append(elapsed)
+                replies.append(reply)
+    start = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    kubios_seconds = time.monotonic() - start
+    received = []
+    broker.on("hr-data", lambda topic, payload: received.append(payload))
+
+    #### RESULTS THROUGH THE OUTBOX, TIMED UNTIL IT IS EMPTY. A BURST LARGER THAN THE OUTBOX DROPS THE OLDEST
+    metrics = {"MEAN_HR_BPM": 70, "MEAN_PPI_MS": 857, "RMSSD_MS": 40, "SDNN_MS": 50}
+    start = time.monotonic()
+    for i in range(args.requests):
+        if i % 2 == 0 or not replies:
+            network.send_hrv_data(metrics, "hr-data")
+        else:
+            network.send_kubios_data(replies[i % len(replies)], "hr-data")
+    queued = time.monotonic() - start
+    while len(network.outbox):
+        await asyncio.sleep(0.001)
+    publish_seconds = time.monotonic() - start
+    await asyncio.sleep(0.05)
+    delivered = len(received)
+
+    print(f"kubios:      {args.requests} requests, {args.concurrency} in flight, latency {args.latency}+{args.jitter} ms, "
+          f"drop {args.drop:.0%}, replies {responder.bytes // max(1, responder.responses):,} bytes")
+    if round_trips:
+        print(f"round-trip:  p50 {percentile(round_trips, 50):.0f} ms, p90 {percentile(round_trips, 90):.0f} ms, "
+              f"p99 {percentile(round_trips, 99):.0f} ms, max {max(round_trips):.0f} ms")
+    print(f"throughput:  {len(round_trips) / kubios_seconds:.1f} replies/s")
+    print(f"timeouts:    {len(timeouts)} of {args.requests} (responder dropped {responder.dropped}), "
+          f"each gave up after {(sum(timeouts) / len(timeouts) if timeouts else 0):.0f} ms, "
+          f"{network.kubios.stale} late replies ignored, {len(network.kubios.pending)} still pending")
+    print(f"hr-data:     {args.requests} results queued in {queued * 1000:.0f} ms, {delivered} delivered "
+          f"at {delivered / publish_seconds:.0f} msgs/s, {network.outbox.dropped} dropped by the outbox")
+
+    failures = []
+    if len(timeouts) != responder.dropped:
+        failures.append(f"{len(timeouts)} Kubios timeouts for {responder.dropped} unanswered requests")
+    if network.kubios.pending:
+        failures.append(f"{len(network.kubios.pending)} Kubios requests still pending")
+    if delivered + network.outbox.dropped != args.requests:
+        failures.append(f"{delivered} results delivered and {network.outbox.dropped} dropped, "
+                        f"expected {args.requests} in all")
+
+    network_task.cancel()
+    clock_task.cancel()
+    network.drop_connection()
+    await broker.stop()
+    return failures
+
+
+def main_entry():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("responsiveness", "reconnect", "kubios", "stream", "load"), default="responsiveness")
+    parser.add_argument("--latency", type=int, help="Kubios reply delay in ms, 3000 for responsiveness, otherwise 200")
+    parser.add_argument("--collect", type=int, default=3, help="measurement length in s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=100, help="load: Kubios requests and results to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="load: Kubios requests in flight at once")
+    parser.add_argument("--jitter", type=int, default=0, help="load: random extra Kubios delay in ms")
+    parser.add_argument("--drop", type=float, default=0.0, help="load: share of Kubios requests never answered")
+    parser.add_argument("--size", type=int, help="load: pad Kubios replies to this many bytes")
+    parser.add_argument("--timeout", type=float, default=10, help="load: Kubios reply timeout in s")
+    args = parser.parse_args()
+    if args.latency is None:
+        args.latency = 3000 if args.scenario == "responsiveness" else 200
+    os.chdir(tempfile.mkdtemp())
+    failures = asyncio.run({"responsiveness": responsiveness, "reconnect": reconnect, "kubios": kubios, "stream": stream,
+                            "load": load}[args.scenario](args)) or []
+    for failure in failures:
+        print(f"FAIL:        {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_entry())
@@ -0,0 +1,219 @@
+""" Local stand-in for the lab MQTT broker and the Kubios bridge behind it.
+
+    Broker speaks enough MQTT 3.1.1 for the device code: CONNECT, SUBSCRIBE, PUBLISH at QoS 0 and 1,
+    PINGREQ and DISCONNECT, with exact topic matching. KubiosResponder answers `kubios-request`
+    messages on `kubios-response` with configurable latency, drop rate and reply size.
+"""
+import asyncio
+import json
+import math
+import random
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def packet(header, body):
+    return bytes([header]) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    body = await reader.readexactly(length) if length else b""
+    return header, body
+
+
+class Broker:
+    def __init__(self, host="127.0.0.1", port=21883):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.subscribers = {}
+        self.handlers = {}
+        self.connections = set()
+        self.received = 0
+        self.delivered = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for writer in list(self.connections):
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def on(self, topic, handler):
+        """ Run handler(topic, payload) for every message published on topic """
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, payload):
+        data = packet(0x30, len(topic).to_bytes(2, "big") + topic.encode() + payload)
+        for writer in list(self.subscribers.get(topic, ())):
+            if writer.is_closing():
+                self.subscribers[topic].discard(writer)
+                continue
+            writer.write(data)
+            self.delivered += 1
+
+    def drop_connections(self):
+        """ Cut every client off without a DISCONNECT, like a broker restart """
+        for writer in list(self.connections):
+            writer.transport.abort()
+
+    async def serve(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header & 0xF0
+                if kind == 0x10:
+                    writer.write(packet(0x20, b"\x00\x00"))
+                elif kind == 0x80:
+                    pid = body[:2]
+                    position = 2
+                    codes = bytearray()
+                    while position < len(body):
+                        length = int.from_bytes(body[position:position + 2], "big")
+                        topic = body[position + 2:position + 2 + length].decode()
+                        position += 2 + length + 1
+                        self.subscribers.setdefault(topic, set()).add(writer)
+                        codes.append(0)
+                    writer.write(packet(0x90, pid + bytes(codes)))
+                elif kind == 0x30:
+                    length = int.from_bytes(body[:2], "big")
+                    topic = body[2:2 + length].decode()
+                    start = 2 + length + (2 if header & 0x06 else 0)
+                    payload = body[start:]
+                    if header & 0x06:
+                        writer.write(packet(0x40, body[2 + length:start]))
+                    self.received += 1
+                    self.publish(topic, payload)
+                    for handler in self.handlers.get(topic, ()):
+                        handler(topic, payload)
+                elif kind == 0xC0:
+                    writer.write(packet(0xD0, b""))
+                elif kind == 0xE0:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            for subscribers in self.subscribers.values():
+                subscribers.discard(writer)
+            writer.close()
+
+
+def readiness_analysis(intervals, detailed=False):
+    """ Kubios-like analysis fields computed from the RR intervals.
+        `detailed` adds the bulk of a real reply: spectra, Poincare and the RR series itself """
+    count = len(intervals) or 1
+    mean_rr = sum(intervals) / count
+    sdnn = math.sqrt(sum((x - mean_rr) ** 2 for x in intervals) / count)
+    diffs = [b - a for a, b in zip(intervals, intervals[1:])]
+    rmssd = math.sqrt(sum(d * d for d in diffs) / len(diffs)) if diffs else 0
+    mean_hr = 60000 / mean_rr if mean_rr else 0
+    analysis = {
+        "artefact": 0,
+        "create_timestamp": "2026-01-01T00:00:00+00:00",
+        "mean_hr_bpm": mean_hr,
+        "mean_rr_ms": mean_rr,
+        "rmssd_ms": rmssd,
+        "sdnn_ms": sdnn,
+        "pns_index": (mean_rr - 926) / 90 / 2 + (rmssd - 42) / 15 / 2,
+        "sns_index": (mean_hr - 66) / 6,
+        "stress_index": 10 + (mean_hr - 66) / 3,
+        "readiness": max(0, min(100, 60 + rmssd - 42)),
+        "freq_domain": {"LF_power": 1054.2, "HF_power": 830.7, "LF_HF_power": 1.27},
+    }
+    if detailed:
+        analysis.update({
+            "artefact_level": "GOOD",
+            "effective_prc": 100.0,
+            "freq_domain": {
+                "LF_power": 1054.2, "HF_power": 830.7, "VLF_power": 212.4, "LF_HF_power": 1.27,
+                "LF_peak": 0.094, "HF_peak": 0.25, "tot_power": 2097.3,
+                "frequency": [i / 256 for i in range(257)],
+                "PSD": [round(900 * math.exp(-((i / 256 - 0.1) * 20) ** 2), 3) for i in range(257)],
+            },
+            "poincare": {"sd1_ms": rmssd / math.sqrt(2), "sd2_ms": sdnn * 1.4},
+            "physiological_age": 31,
+            "respiratory_rate": 14.2,
+            "result_version": "2.0.0",
+            "rr_intervals": list(intervals),
+        })
+    return analysis
+
+
+class KubiosResponder:
+    """ Replies to kubios-request with a readiness analysis of the intervals, like the Kubios bridge.
+
+        latency_ms      delay before replying, plus a random 0..jitter_ms
+        drop_rate       share of requests that never get a reply
+        response_size   pads every reply to about this many bytes, None leaves them as they are """
+    def __init__(self, broker, latency_ms=500, request_topic="kubios-request", response_topic="kubios-response",
+                 detailed=True, jitter_ms=0, drop_rate=0.0, response_size=None, seed=1):
+        self.broker = broker
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.drop_rate = drop_rate
+        self.response_size = response_size
+        self.detailed = detailed
+        self.response_topic = response_topic
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.responses = 0
+        self.dropped = 0
+        self.bytes = 0
+        broker.on(request_topic, self.handle)
+
+    def handle(self, topic, payload):
+        self.requests += 1
+        request = json.loads(payload)
+        if self.random.random() < self.drop_rate:
+            self.dropped += 1
+            return
+        asyncio.get_running_loop().create_task(self.respond(request))
+
+    def build_response(self, request):
+        return {
+            "id": request["id"],
+            "type": "readiness",
+            "data": {"status": "ok", "analysis": readiness_analysis(request["data"], self.detailed)},
+        }
+
+    def encode(self, response):
+        payload = json.dumps(response).encode()
+        if self.response_size and len(payload) < self.response_size:
+            response["data"]["analysis"]["padding"] = ""
+            pad = self.response_size - len(json.dumps(response))
+            response["data"]["analysis"]["padding"] = "x" * max(0, pad)
+            payload = json.dumps(response).encode()
+        return payload
+
+    async def respond(self, request):
+        await asyncio.sleep((self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000)
+        payload = self.encode(self.build_response(request))
+        self.responses += 1
+        self.bytes += len(payload)
+        self.broker.publish(self.response_topic, payload)
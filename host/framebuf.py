@@ -0,0 +1,102 @@
+""" Pure Python stand-in for MicroPython's framebuf, MONO_VLSB only.
+    text() does not carry the real font, it draws a fixed pattern per character
+    so screens still produce a realistic amount of drawing and changed bytes """
+MONO_VLSB = 0
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format=MONO_VLSB, stride=None):
+        self.buf = buffer
+        self.fb_width = width
+        self.fb_height = height
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.fb_width and 0 <= y < self.fb_height):
+            return None
+        index = (y >> 3) * self.fb_width + x
+        bit = 1 << (y & 7)
+        if c is None:
+            return 1 if self.buf[index] & bit else 0
+        if c:
+            self.buf[index] |= bit
+        else:
+            self.buf[index] &= ~bit & 0xFF
+
+    def fill(self, c):
+        value = 0xFF if c else 0
+        for i in range(len(self.buf)):
+            self.buf[i] = value
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(0, y), min(self.fb_height, y + h)):
+            for xx in range(max(0, x), min(self.fb_width, x + w)):
+                self.pixel(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                break
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        for n, ch in enumerate(s):
+            code = ord(ch)
+            if code == 32:
+                continue
+            for col in range(7):
+                bits = (code * (col + 3)) & 0x7E
+                for row in range(8):
+                    if bits & (1 << row):
+                        self.pixel(x + n * 8 + col, y + row, c)
+
+    def scroll(self, xstep, ystep):
+        width, height = self.fb_width, self.fb_height
+        if ystep == 0:
+            """ Horizontal scrolls move whole bytes within each page, like the C version does """
+            for page in range((height + 7) // 8):
+                row = page * width
+                if xstep < 0:
+                    self.buf[row:row + width + xstep] = self.buf[row - xstep:row + width]
+                elif xstep > 0:
+                    self.buf[row + xstep:row + width] = self.buf[row:row + width - xstep]
+            return
+        old = [[self.pixel(x, y) for x in range(width)] for y in range(height)]
+        for y in range(height):
+            for x in range(width):
+                sx, sy = x - xstep, y - ystep
+                if 0 <= sx < width and 0 <= sy < height:
+                    self.pixel(x, y, old[sy][sx])
+
+    def blit(self, fbuf, x, y, key=-1):
+        for yy in range(fbuf.fb_height):
+            for xx in range(fbuf.fb_width):
+                c = fbuf.pixel(xx, yy)
+                if c != key:
+                    self.pixel(x + xx, y + yy, c)
@@ -0,0 +1,73 @@
+""" Stand-in for the parts of MicroPython's machine module the project uses """
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self._value = value
+        self.handler = None
+        self.trigger = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self.handler = handler
+        self.trigger = trigger
+
+    def fire(self):
+        """ Simulate an edge on the pin, calling the registered IRQ handler """
+        if self.handler:
+            self.handler(self)
+
+
+class ADC:
+    """ read_u16() returns samples from `source`, a callable shared by all ADC instances
+        unless one is set per instance """
+    source = staticmethod(lambda: 32768)
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def read_u16(self):
+        return self.source()
+
+
+class I2C:
+    """ Records the traffic instead of driving a bus. bus_time_us estimates what the
+        transfer would take at `freq`, with 9 clocks per byte plus the address byte """
+    def __init__(self, id, scl=None, sda=None, freq=400000):
+        self.id = id
+        self.freq = freq
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bus_time_us = 0
+
+    def _account(self, nbytes):
+        self.transactions += 1
+        self.bytes_written += nbytes
+        self.bus_time_us += (nbytes + 1) * 9 * 1000000 // self.freq
+
+    def writeto(self, addr, buf, stop=True):
+        self._account(len(buf))
+        return 1
+
+    def writevto(self, addr, vector, stop=True):
+        self._account(sum(len(buf) for buf in vector))
+        return 1
+
+    def scan(self):
+        return [0x3C]
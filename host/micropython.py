@@ -0,0 +1,27 @@
+""" Stand-in for MicroPython's micropython module.
+
+    native and viper compile nothing here, the decorated functions run as plain Python.
+    Viper's pointer casts are made builtins that return the buffer itself, so indexing the
+    "pointer" indexes the array and viper code runs unchanged, only slower """
+import builtins
+
+
+def const(value):
+    return value
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def _pointer(buf):
+    return buf
+
+
+builtins.ptr8 = _pointer
+builtins.ptr16 = _pointer
+builtins.ptr32 = _pointer
@@ -0,0 +1,35 @@
+""" Stand-in for MicroPython's network module. Association succeeds after `connect_delay_ms`
+    of virtual or real time, depending on how the clock is driven """
+import time
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN:
+    connect_delay_ms = 0
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connect_started = None
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = bool(value)
+
+    def connect(self, ssid=None, password=None):
+        self.ssid = ssid
+        self._connect_started = time.ticks_ms()
+
+    def disconnect(self):
+        self._connect_started = None
+
+    def isconnected(self):
+        if not self._active or self._connect_started is None:
+            return False
+        return time.ticks_diff(time.ticks_ms(), self._connect_started) >= self.connect_delay_ms
+
+    def ifconfig(self):
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
@@ -0,0 +1,28 @@
+""" Stand-in for pico-lib's Piotimer, driven by the virtual clock in sim.py """
+from sim import clock
+
+
+class Piotimer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=0, mode=PERIODIC, freq=-1, period=-1, callback=None):
+        self.mode = mode
+        self.callback = callback
+        if freq > 0:
+            self.period_us = 1000000 // freq
+        else:
+            self.period_us = period * 1000
+        self.next_due_us = clock.now_us + self.period_us
+        clock.add_timer(self)
+
+    def fire(self):
+        if self.mode == Piotimer.PERIODIC:
+            self.next_due_us += self.period_us
+        else:
+            self.deinit()
+        if self.callback:
+            self.callback(self)
+
+    def deinit(self):
+        clock.remove_timer(self)
@@ -0,0 +1,109 @@
+""" Synthetic PPG signal with known beat times, for driving the fake ADC """
+import math
+import random
+
+
+class SyntheticPPG:
+    """ Generates u16 ADC samples of a finger PPG.
+
+        bpm         mean heart rate
+        hrv_ms      standard deviation of the beat to beat intervals
+        noise       gaussian noise in ADC counts
+        wander      amplitude of the baseline wander in ADC counts
+        wander_hz   frequency of the baseline wander (breathing is ~0.25 Hz)
+
+        Every generated beat onset is recorded in `beat_times_ms`, and the
+        intervals between them in `intervals`, as ground truth for the detector """
+    def __init__(self, bpm=72, hrv_ms=40, noise=150, wander=1500, wander_hz=0.25,
+                 amplitude=6000, baseline=30000, sample_rate=200, seed=1):
+        self.mean_interval = 60000 / bpm
+        self.hrv_ms = hrv_ms
+        self.noise = noise
+        self.wander = wander
+        self.wander_hz = wander_hz
+        self.amplitude = amplitude
+        self.baseline = baseline
+        self.sample_period_ms = 1000 / sample_rate
+        self.random = random.Random(seed)
+        self.t_ms = 0.0
+        self.beat_start = 0.0
+        self.beat_length = self._next_interval()
+        self.beat_times_ms = [0.0]
+        self.intervals = []
+
+    def _next_interval(self):
+        """ Breathing modulates the interval (RSA) on top of random variation """
+        rsa = 0.5 * self.hrv_ms * math.sin(2 * math.pi * self.wander_hz * self.t_ms / 1000)
+        interval = self.mean_interval + rsa + self.random.gauss(0, self.hrv_ms * 0.85)
+        return min(1500, max(333, interval))
+
+    def _pulse(self, tau):
+        """ Systolic peak followed by a smaller dicrotic wave, tau in seconds since onset """
+        systolic = math.exp(-((tau - 0.12) / 0.05) ** 2)
+        dicrotic = 0.35 * math.exp(-((tau - 0.32) / 0.06) ** 2)
+        return systolic + dicrotic
+
+    def read(self):
+        self.t_ms += self.sample_period_ms
+        while self.t_ms - self.beat_start >= self.beat_length:
+            self.beat_start += self.beat_length
+            self.intervals.append(round(self.beat_length))
+            self.beat_times_ms.append(self.beat_start)
+            self.beat_length = self._next_interval()
+        tau = (self.t_ms - self.beat_start) / 1000
+        value = self.baseline + self.amplitude * self._pulse(tau)
+        value += self.wander * math.sin(2 * math.pi * self.wander_hz * self.t_ms / 1000)
+        value += self.random.gauss(0, self.noise)
+        return min(65535, max(0, int(value)))
+
+    def samples(self, count):
+        return [self.read() for _ in range(count)]
+
+
+def load_trace(path):
+    """ Reads a recorded trace, one ADC value per line (the pico-lib capture format) """
+    with open(path) as f:
+        return [int(float(line)) for line in f if line.strip()]
+
+
+def load_beats(path):
+    """ Reads the true beat times of a recorded trace, one time in ms per line """
+    with open(path) as f:
+        return [float(line) for line in f if line.strip()]
+
+
+def match_intervals(detected_times, true_times, tolerance_ms=150):
+    """ Pairs detected beats with true beats and compares the intervals between paired beats.
+        The detector has a roughly constant delay from the onset, so the delay is estimated
+        first and removed before pairing """
+    if not detected_times or len(true_times) < 2:
+        return {"matched": 0, "missed": len(true_times), "extra": len(detected_times), "mae_ms": None, "max_ms": None}
+    delays = []
+    j = 0
+    for t in detected_times:
+        while j + 1 < len(true_times) and true_times[j + 1] <= t:
+            j += 1
+        delays.append(t - true_times[j])
+    delays.sort()
+    delay = delays[len(delays) // 2]
+
+    pairs = []
+    j = 0
+    for t in detected_times:
+        target = t - delay
+        while j + 1 < len(true_times) and abs(true_times[j + 1] - target) < abs(true_times[j] - target):
+            j += 1
+        if abs(true_times[j] - target) <= tolerance_ms:
+            if not pairs or pairs[-1][1] != j:
+                pairs.append((t, j))
+    errors = []
+    for (t0, j0), (t1, j1) in zip(pairs, pairs[1:]):
+        if j1 == j0 + 1:
+            errors.append(abs((t1 - t0) - (true_times[j1] - true_times[j0])))
+    return {
+        "matched": len(pairs),
+        "missed": len(true_times) - len(pairs),
+        "extra": len(detected_times) - len(pairs),
+        "mae_ms": sum(errors) / len(errors) if errors else None,
+        "max_ms": max(errors) if errors else None,
+    }
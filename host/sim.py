@@ -0,0 +1,95 @@
+""" Host side stand-ins for the Pico hardware.
+
+    Put this directory on sys.path (running a script from here does that) and call install().
+    After that `machine`, `piotimer`, `ssd1306`, `network`, `uasyncio`, `fifo` and
+    `micropython` resolve to the fakes next to this file, and time.ticks_ms() and friends read the
+    virtual clock.
+"""
+import os
+import gc
+import sys
+import time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+
+
+class VirtualClock:
+    """ Microsecond clock that only moves when advance() is called.
+        Periodic timers registered here fire in order while the clock advances """
+    def __init__(self, start_ms=1000):
+        self.now_us = start_ms * 1000
+        self.timers = []
+
+    def reset(self, start_ms=1000):
+        self.now_us = start_ms * 1000
+        self.timers = []
+
+    def add_timer(self, timer):
+        self.timers.append(timer)
+
+    def remove_timer(self, timer):
+        if timer in self.timers:
+            self.timers.remove(timer)
+
+    def advance_us(self, us):
+        target = self.now_us + us
+        while self.timers:
+            timer = min(self.timers, key=lambda t: t.next_due_us)
+            if timer.next_due_us > target:
+                break
+            self.now_us = timer.next_due_us
+            timer.fire()
+        self.now_us = target
+
+    def advance(self, ms):
+        self.advance_us(int(ms * 1000))
+
+    async def run_realtime(self, step_ms=5):
+        """ Task that keeps the virtual clock in step with wall time, for running the async parts """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(step_ms / 1000)
+            now = loop.time()
+            self.advance_us(int((now - last) * 1000000))
+            last = now
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & TICKS_MAX
+
+
+clock = VirtualClock()
+
+
+def ticks_diff(a, b):
+    return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def install():
+    """ Make the stand-ins importable and give the time module the MicroPython ticks API """
+    for path in (REPO_DIR, HOST_DIR):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    time.ticks_ms = lambda: clock.ticks_ms()
+    time.ticks_us = lambda: clock.ticks_us()
+    time.ticks_diff = ticks_diff
+    time.ticks_add = ticks_add
+    time.sleep_ms = lambda ms: clock.advance(ms)
+    time.sleep_us = lambda us: clock.advance_us(us)
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 0 #### NO HEAP LIMIT ON THE HOST, THE BENCHES MEASURE MEMORY WITH tracemalloc
+    return clock
@@ -0,0 +1,27 @@
+""" uasyncio on top of CPython's asyncio, with the MicroPython only helpers added """
+from asyncio import *
+import asyncio as _asyncio
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout / 1000)
+
+
+class ThreadSafeFlag:
+    """ On the host the IRQ and timer callbacks run on the event loop thread, so an Event is enough """
+    def __init__(self):
+        self._event = _asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
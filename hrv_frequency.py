@@ -0,0 +1,193 @@
+from array import array
+import math
+import time
+from hrv_monitoring import HRVStats
+
+class HRVFrequency:
+    """ Local frequency-domain HRV, so an ADVANCED HRV result does not have to wait for Kubios.
+
+        The RR intervals are resampled onto a uniform 4 Hz grid by linear interpolation, detrended,
+        Hann windowed and run through a radix-2 FFT. LF (0.04-0.15 Hz) and HF (0.15-0.4 Hz) power
+        are the PSD summed over each band. All buffers are allocated here, sized for `max_seconds`
+        of recording, and reused by every analysis.
+
+        A 30 s recording gives a 1/30 Hz resolution, only three bins in the LF band, so LF is rough
+        on short recordings. Kubios itself asks for two minutes or more for LF """
+    LF_BAND = (0.04, 0.15)
+    HF_BAND = (0.15, 0.4)
+
+    def __init__(self, max_seconds=300, sample_rate=4):
+        self.sample_rate = sample_rate
+        self.step_ms = 1000 // sample_rate
+        size = 1
+        while size < max_seconds * sample_rate:
+            size *= 2
+        self.size = size
+        self.re = array('f', [0] * size)
+        self.im = array('f', [0] * size)
+        self.cos = array('f', [math.cos(2 * math.pi * k / size) for k in range(size // 2)])
+        self.sin = array('f', [math.sin(2 * math.pi * k / size) for k in range(size // 2)])
+
+    def resample(self, intervals):
+        """ RR interval at every grid step between the first and the last beat, into self.re.
+            Each interval is placed at the time of the beat that ends it. Returns the sample count """
+        beat = intervals[0]
+        t = beat
+        previous_t = t
+        previous_rr = intervals[0]
+        n = 0
+        for i in range(1, len(intervals)):
+            rr = intervals[i]
+            beat += rr
+            while t <= beat and n < self.size:
+                self.re[n] = previous_rr + (rr - previous_rr) * (t - previous_t) / rr
+                n += 1
+                t += self.step_ms
+            previous_t = beat
+            previous_rr = rr
+        return n
+
+    def detrend_and_window(self, n):
+        """ Removes the least squares line and applies a Hann window. Returns the window's power sum """
+        re = self.re
+        mean_x = (n - 1) / 2
+        mean_y = sum(re[i] for i in range(n)) / n
+        sxx = sxy = 0.0
+        for i in range(n):
+            dx = i - mean_x
+            sxx += dx * dx
+            sxy += dx * (re[i] - mean_y)
+        slope = sxy / sxx if sxx else 0.0
+        power = 0.0
+        for i in range(n):
+            w = 0.5 - 0.5 * math.cos(2 * math.pi * i / (n - 1))
+            re[i] = (re[i] - mean_y - slope * (i - mean_x)) * w
+            self.im[i] = 0.0
+            power += w * w
+        return power
+
+    def fft(self, n):
+        """ In-place iterative radix-2 FFT of the first n values of re/im, n a power of two """
+        re = self.re
+        im = self.im
+        j = 0
+        for i in range(1, n):
+            bit = n >> 1
+            while j & bit:
+                j ^= bit
+                bit >>= 1
+            j |= bit
+            if i < j:
+                re[i], re[j] = re[j], re[i]
+                im[i], im[j] = im[j], im[i]
+        length = 2
+        while length <= n:
+            half = length >> 1
+            stride = self.size // length
+            for k in range(half):
+                wr = self.cos[k * stride]
+                wi = -self.sin[k * stride]
+                for a in range(k, n, length):
+                    b = a + half
+                    tr = wr * re[b] - wi * im[b]
+                    ti = wr * im[b] + wi * re[b]
+                    re[b] = re[a] - tr
+                    im[b] = im[a] - ti
+                    re[a] += tr
+                    im[a] += ti
+            length <<= 1
+
+    def spectrum(self, intervals):
+        """ LF and HF band powers in ms^2, their peak frequencies and the LF/HF ratio """
+        result = {"LF_power": 0.0, "HF_power": 0.0, "LF_HF_power": 0.0, "LF_peak": 0.0, "HF_peak": 0.0,
+                  "tot_power": 0.0}
+        if len(intervals) < 4:
+            return result
+        n = self.resample(intervals)
+        if n < 8:
+            return result
+        window_power = self.detrend_and_window(n)
+        size = 8
+        while size < n:
+            size *= 2
+        for i in range(n, size):
+            self.re[i] = 0.0
+            self.im[i] = 0.0
+        self.fft(size)
+
+        df = self.sample_rate / size
+        scale = 2 / (self.sample_rate * window_power) * df
+        lf = hf = total = 0.0
+        lf_best = hf_best = 0.0
+        for k in range(1, size // 2):
+            f = k * df
+            p = (self.re[k] * self.re[k] + self.im[k] * self.im[k]) * scale
+            total += p
+            if self.LF_BAND[0] <= f < self.LF_BAND[1]:
+                lf += p
+                if p > lf_best:
+                    lf_best = p
+                    result["LF_peak"] = f
+            elif self.HF_BAND[0] <= f < self.HF_BAND[1]:
+                hf += p
+                if p > hf_best:
+                    hf_best = p
+                    result["HF_peak"] = f
+        result["LF_power"] = lf
+        result["HF_power"] = hf
+        result["LF_HF_power"] = lf / hf if hf else 0.0
+        result["tot_power"] = total
+        return result
+
+    def stress_index(self, intervals):
+        """ Square root of Baevsky's stress index, which is the scale Kubios reports """
+        low = min(intervals)
+        high = max(intervals)
+        bins = {}
+        for rr in intervals:
+            key = rr // 50
+            bins[key] = bins.get(key, 0) + 1
+        mode_bin = max(bins, key=bins.get)
+        amo = bins[mode_bin] * 100 / len(intervals)
+        mo = (mode_bin * 50 + 25) / 1000
+        mxdmn = max(high - low, 50) / 1000
+        return math.sqrt(amo / (2 * mo * mxdmn))
+
+    def analyse(self, intervals, id=0):
+        """ A readiness reply in the shape Kubios sends, so UI.kubios_extract reads either.
+
+            PNS and SNS follow Kubios' recipe of averaging z-scores against population norms:
+            mean RR, RMSSD and SD1 for PNS, mean HR, stress index and SD2 for SNS. The readiness
+            score is our own approximation from the two, Kubios does not publish its formula """
+        stats = HRVStats()
+        for rr in intervals:
+            stats.add(rr)
+        mean_rr = stats.mean_ppi()
+        mean_hr = stats.mean_hr()
+        rmssd = stats.rmssd()
+        sdnn = stats.sdnn()
+        sd1 = rmssd / math.sqrt(2)
+        sd2 = math.sqrt(max(0, 2 * sdnn * sdnn - sd1 * sd1))
+        stress = self.stress_index(intervals) if intervals else 0
+        sd1_nu = sd1 / mean_rr * 100 if mean_rr else 0
+        sd2_nu = sd2 / mean_rr * 100 if mean_rr else 0
+        pns = ((mean_rr - 926) / 90 + (rmssd - 42) / 15 + (sd1_nu - 3.12) / 1.01) / 3
+        sns = ((mean_hr - 66) / 6 + (stress - 10) / 3 + (sd2_nu - 6.12) / 1.61) / 3
+        readiness = max(0, min(100, 60 + 10 * (pns - sns)))
+        t = time.localtime()
+        analysis = {
+            "artefact": 0,
+            "create_timestamp": "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}+00:00".format(*t[:6]),
+            "mean_hr_bpm": mean_hr,
+            "mean_rr_ms": mean_rr,
+            "rmssd_ms": rmssd,
+            "sdnn_ms": sdnn,
+            "pns_index": pns,
+            "sns_index": sns,
+            "stress_index": stress,
+            "readiness": readiness,
+            "freq_domain": self.spectrum(intervals),
+            "poincare": {"sd1_ms": sd1, "sd2_ms": sd2},
+        }
+        return {"id": str(id), "type": "readiness", "source": "local",
+                "data": {"status": "ok", "analysis": analysis}}
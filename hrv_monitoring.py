@@ -1,64 +1,110 @@
 from machine import ADC, Pin
-import time
 import math
 from heartbeat_monitoring import HeartbeatMonitor
 import uasyncio as asyncio
 
+class HRVStats:
+    """ Running HRV statistics, updated once per interval.
+        Mean and variance use Welford's method, RMSSD keeps a running sum of squared successive differences """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sum_sq_diffs = 0
+        self.previous = None
+
+    def add(self, interval):
+        self.count += 1
+        self.total += interval
+        delta = interval - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (interval - self.mean)
+        if self.previous is not None:
+            diff = interval - self.previous
+            self.sum_sq_diffs += diff * diff
+        self.previous = interval
+
+    def mean_ppi(self):
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+    def mean_hr(self):
+        mean_ppi = self.mean_ppi()
+        if mean_ppi == 0:
+            return 0
+        return 60000 / mean_ppi
+
+    def rmssd(self):
+        if self.count < 2:
+            return 0
+        return math.sqrt(self.sum_sq_diffs / (self.count - 1))
+
+    def sdnn(self):
+        if not self.count:
+            return 0
+        return math.sqrt(self.m2 / self.count)
+
+    def metrics(self):
+        return {
+            'MEAN_PPI_MS': self.mean_ppi(),
+            'MEAN_HR_BPM': self.mean_hr(),
+            'RMSSD_MS': self.rmssd(),
+            'SDNN_MS': self.sdnn(),
+            'INTERVAL_COUNT': self.count
+        }
+
 class HRV_Monitor:
-    def __init__(self, monitor, collection_duration=30000):
+    def __init__(self, monitor, collection_duration=30000, stream=None):
         self.monitor = monitor
         self.collection_duration = collection_duration 
         self.intervals = [] 
+        self.stats = HRVStats()
+        self.stream = stream #### OPTIONAL RRStreamer THAT PUBLISHES THE INTERVALS WHILE WE COLLECT
+
+    def add_interval(self, interval):
+        self.intervals.append(interval)
+        self.stats.add(interval)
+        if self.stream:
+            self.stream.add(interval)
 
     async def collect_data(self):
+        """ The monitor's own run() task does the sampling and hands us every interval,
+            so this only has to wait out the collection time """
         self.intervals = []
+        self.stats.reset()
+        self.monitor.on_interval = self.add_interval
         self.monitor.start()
-        
-        start_time = time.ticks_ms()
-        while time.ticks_diff(time.ticks_ms(), start_time) < self.collection_duration:
-            self.monitor.process()
-            if self.monitor.intervals:
-                self.intervals.extend(self.monitor.intervals)
-                self.monitor.intervals = []
-            await asyncio.sleep_ms(5)
-        
-        self.monitor.stop()
+        if self.stream:
+            self.stream.start()
+        try:
+            await asyncio.sleep_ms(self.collection_duration)
+        finally:
+            self.monitor.stop()
+            self.monitor.on_interval = None
+            if self.stream:
+                self.stream.stop()
+
+    def live_metrics(self):
+        """ Metrics of the intervals collected so far, readable while collect_data is running """
+        return self.stats.metrics()
 
     def calculate_mean_ppi(self):
-        if not self.intervals:
-            return 0
-        return sum(self.intervals) / len(self.intervals)
+        return self.stats.mean_ppi()
 
     def calculate_mean_hr(self):
-        mean_ppi = self.calculate_mean_ppi()
-        if mean_ppi == 0:
-            return 0
-        return 60000 / mean_ppi
+        return self.stats.mean_hr()
 
     def calculate_rmssd(self):
-        if len(self.intervals) < 2:
-            return 0 
-        squared_diffs = [(self.intervals[i+1] - self.intervals[i])**2 for i in range(len(self.intervals)-1)]
-        mean_squared_diffs = sum(squared_diffs) / len(squared_diffs)
-        return math.sqrt(mean_squared_diffs)
+        return self.stats.rmssd()
 
     def calculate_sdnn(self):
-        if not self.intervals:
-            return 0
-        mean_ppi = self.calculate_mean_ppi()
-        squared_deviations = [(interval - mean_ppi)**2 for interval in self.intervals]
-        mean_squared_deviations = sum(squared_deviations) / len(squared_deviations)
-        return math.sqrt(mean_squared_deviations)
+        return self.stats.sdnn()
 
     async def calculate_all_metrics(self):
         await self.collect_data()
-        
-        metrics = {
-            'MEAN_PPI_MS': self.calculate_mean_ppi(),
-            'MEAN_HR_BPM': self.calculate_mean_hr(),
-            'RMSSD_MS': self.calculate_rmssd(),
-            'SDNN_MS': self.calculate_sdnn(),
-            'INTERVAL_COUNT': len(self.intervals)
-        }
-        
-        return metrics
\ No newline at end of file
+        return self.stats.metrics()
@@ -0,0 +1,124 @@
+""" Field-selective JSON reading for large MQTT payloads.
+
+    extract() walks the raw bytes once and decodes only the values at the wanted key paths.
+    Everything else is skipped by scanning for its end, so no dicts, lists or strings are built
+    for it and peak memory stays near the size of the payload itself.
+    The result keeps the document's nesting, so code reading message["data"]["analysis"][...] works unchanged """
+import json
+
+SPACE = (32, 9, 10, 13)
+QUOTE = 34
+BACKSLASH = 92
+COLON = 58
+COMMA = 44
+OPEN_OBJECT = 123
+CLOSE_OBJECT = 125
+OPEN_ARRAY = 91
+CLOSE_ARRAY = 93
+SCALAR_END = (COMMA, CLOSE_OBJECT, CLOSE_ARRAY) + SPACE
+
+def fields(*paths):
+    """ Turns dotted key paths such as "data.analysis.rmssd_ms" into the lookup tree extract() takes.
+        Asking for a whole value and for something inside it gives the whole value """
+    tree = {}
+    for path in paths:
+        node = tree
+        keys = path.split(".")
+        for key in keys[:-1]:
+            node = node.setdefault(key.encode(), {})
+            if node is None:
+                break
+        else:
+            node[keys[-1].encode()] = None
+    return tree
+
+def skip_space(buf, i):
+    while buf[i] in SPACE:
+        i += 1
+    return i
+
+def string_end(buf, i):
+    """ Index just past the string starting at the quote at i """
+    while True:
+        j = buf.find(b'"', i + 1)
+        if j < 0:
+            raise ValueError("unterminated string")
+        k = j - 1
+        while buf[k] == BACKSLASH:
+            k -= 1
+        if (j - 1 - k) % 2 == 0:
+            return j + 1
+        i = j
+
+def value_end(buf, i):
+    """ Index just past the value starting at i, found without decoding it """
+    c = buf[i]
+    if c == QUOTE:
+        return string_end(buf, i)
+    n = len(buf)
+    if c == OPEN_OBJECT or c == OPEN_ARRAY:
+        depth = 0
+        while i < n:
+            c = buf[i]
+            if c == QUOTE:
+                i = string_end(buf, i)
+                continue
+            if c == OPEN_OBJECT or c == OPEN_ARRAY:
+                depth += 1
+            elif c == CLOSE_OBJECT or c == CLOSE_ARRAY:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        raise ValueError("unterminated container")
+    while i < n and buf[i] not in SCALAR_END:
+        i += 1
+    return i
+
+def scan_object(buf, i, wanted, out):
+    """ Fills out with the wanted members of the object starting at i. Returns the index just past it """
+    i = skip_space(buf, i + 1)
+    if buf[i] == CLOSE_OBJECT:
+        return i + 1
+    while True:
+        if buf[i] != QUOTE:
+            raise ValueError("expected a key at %d" % i)
+        end = string_end(buf, i)
+        key = buf[i + 1:end - 1]
+        i = skip_space(buf, end)
+        if buf[i] != COLON:
+            raise ValueError("expected ':' at %d" % i)
+        i = skip_space(buf, i + 1)
+        if key in wanted:
+            sub = wanted[key]
+            if sub is None:
+                end = value_end(buf, i)
+                out[key.decode()] = json.loads(buf[i:end])
+            elif buf[i] == OPEN_OBJECT:
+                child = {}
+                end = scan_object(buf, i, sub, child)
+                out[key.decode()] = child
+            else:
+                end = value_end(buf, i)
+        else:
+            end = value_end(buf, i)
+        i = skip_space(buf, end)
+        if buf[i] == CLOSE_OBJECT:
+            return i + 1
+        if buf[i] != COMMA:
+            raise ValueError("expected ',' at %d" % i)
+        i = skip_space(buf, i + 1)
+
+def extract(buf, wanted):
+    """ The members of the JSON object in buf that are named in wanted, a tree from fields().
+        Keys are compared as raw bytes, so a key written with escape sequences is not matched.
+        Missing keys are simply absent from the result. Raises ValueError on malformed input """
+    try:
+        i = skip_space(buf, 0)
+        if buf[i] != OPEN_OBJECT:
+            raise ValueError("expected an object")
+        out = {}
+        scan_object(buf, i, wanted, out)
+        return out
+    except IndexError:
+        raise ValueError("truncated JSON")
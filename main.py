@@ -1,31 +1,54 @@
 from fifo import Fifo
 from controls import Encoder
-from heartbeat_monitoring import HeartbeatMonitor
-from networker import Network
+from heartbeat_monitoring import HeartbeatMonitor, DETECTORS
+from networker import Network, RRStreamer
 from ui import UI
 from hrv_monitoring import HRV_Monitor
+from hrv_frequency import HRVFrequency
 from history import History
+from display import Display
+from stats import Stats
 import uasyncio as asyncio
-import time
+
+PPG_INTERVAL_MS = 40 #### THE PPG PLOT ONLY DRAWS NEW SAMPLES, TWO PER FRAME AT THE MONITOR'S 50 HZ DISPLAY RATE
+RR_STREAM_TOPIC = None #### SET TO A TOPIC, E.G. "hr-rr", TO PUBLISH INTERVALS LIVE DURING HRV MEASUREMENTS
+STATS_ENABLED = True #### STAGE TIMINGS AND FIFO COUNTERS, FALSE LEAVES THE MEASURED CODE UNTOUCHED
+STATS_TOPIC = None #### SET TO A TOPIC, E.G. "hr-stats", TO PUBLISH THE COUNTERS EVERY STATS_INTERVAL_MS
+STATS_INTERVAL_MS = 10000
+BEAT_DETECTOR = "kernel" #### ONE OF DETECTORS: "kernel", "threshold", "slope" OR "peak", COMPARED BY host/bench.py
+SAMPLE_RATE = 250 #### PIOTIMER RATE IN HZ DURING HRV MEASUREMENTS, THE "kernel" DETECTOR'S 32 BIT SUMS CAP IT AT ABOUT 4.3 KHZ WITH 75 MS SMOOTHING
+PREVIEW_RATE = 100 #### RATE ON THE HEARTRATE SCREEN, WHICH ONLY SHOWS THE BPM AND THE PLOT
 
 class MainMenu:
     def __init__(self):
         self.running = False
-        self.monitor = HeartbeatMonitor(26, 200)
-        self.hrv_monitor = HRV_Monitor(self.monitor)
-        self.enc = Encoder()
-        self.history = History(self.enc)
+        self.monitor = HeartbeatMonitor(26, SAMPLE_RATE, DETECTORS[BEAT_DETECTOR](SAMPLE_RATE),
+                                        PREVIEW_RATE, DETECTORS[BEAT_DETECTOR](PREVIEW_RATE))
         self.network = Network("KMD652_Group_3", "BlendiFaiezeVeeti", "192.168.3.253")
-        self.options = ["HEARTRATE", "HRV ANALYSIS", "ADVANCED HRV", "HISTORY"]
+        self.rr_stream = RRStreamer(self.network, RR_STREAM_TOPIC) if RR_STREAM_TOPIC else None
+        self.hrv_monitor = HRV_Monitor(self.monitor, stream=self.rr_stream)
+        self.enc = Encoder()
+        self.display = Display()
+        self.history = History(self.display)
+        self.options = ["HEARTRATE", "HRV ANALYSIS", "ADVANCED HRV", "HISTORY", "DIAGNOSTICS"]
         self.selected = 0
         self.current_menu = "main"
-        self.ui = UI(self.options, self.selected, self.monitor.get_bpm())
-        self.last_display_time = 0 #### VARIABLE FOR SHOWING REALTIME PPG AND HR
-        self.last_ppg_time = 0 #### THIS IS ALSO A VARIABLE FOR THE REALTIME PPG
+        self.ui = UI(self.options, self.selected, self.monitor.get_bpm(), self.display)
+        self.ui_changed = asyncio.Event() #### SET AFTER INPUT SO THE RENDER TASK REDRAWS
         self.hrv_metrics = None #### METRICS AFTER MEASURING HRV TO BE SHOWN ON THE SCREEN
         self.intervals = self.hrv_monitor.intervals #### INTERVALS TO BE SENT TO KUBIOS 
         self.id = 0  #### THIS IS THE ID WHEN SENDING KUBIOS REQUESTS
         self.kubios_extracted = None #### THE CLEAN DATA FROM KUBIOS TO BE SHOWN ON THE DISPLAY
+        self.kubios_source = "LOCAL" #### WHO MADE THE RESULTS ON SCREEN, THE LOCAL ANALYSIS OR KUBIOS
+        self.frequency = HRVFrequency(self.hrv_monitor.collection_duration // 1000) #### BUFFERS SIZED FOR ONE MEASUREMENT
+        self.stats = Stats(STATS_ENABLED)
+        self.stats.instrument(self.monitor, "process")
+        self.stats.instrument(self.ui, "draw_ppg")
+        self.stats.instrument(self.display, "show")
+        self.stats.watch("adc", self.monitor.capture)
+        self.stats.watch("encoder", self.enc.fifo)
+        self.stats.add_source("display", self.display.stats)
+        self.stats.add_source("outbox", self.network.outbox.stats)
 
     def handle_input(self, fifo):
         """  HANDLE ENCODER INPUT BASED ON CURRENT MENU   """
@@ -37,14 +60,20 @@ class MainMenu:
             elif fifo == 2:
                 if self.selected == 0:
                     self.running = True
-                    self.monitor.start()
+                    self.monitor.start(preview=True)
                     self.current_menu = "heart_rate"
                 elif self.selected == 1:
                     self.current_menu = "hrv"
                 elif self.selected == 2:
                     self.current_menu = "kubios_menu"
                 elif self.selected == 3:
-                    self.history.run()
+                    self.history.open()
+                    self.current_menu = "history"
+                elif self.selected == 4:
+                    self.current_menu = "diagnostics"
+        elif self.current_menu == "history":
+            if not self.history.handle_input(fifo):
+                self.current_menu = "main"
         elif self.current_menu == "heart_rate":
             if fifo == 2:
                 self.running = False
@@ -56,7 +85,7 @@ class MainMenu:
         elif self.current_menu == "kubios_menu":
             if fifo == 2:
                 self.current_menu = "kubios_measure"
-        elif self.current_menu == "hrv_results" or self.current_menu == "kubios_results":
+        elif self.current_menu in ("hrv_results", "kubios_results", "diagnostics"):
             if fifo == 2:
                 self.current_menu = "main"
 
@@ -70,29 +99,73 @@ class MainMenu:
             self.ui.hrv_menu()
         elif self.current_menu == "heart_rate":
             bpm = self.monitor.get_bpm()
-            self.ui.draw_ppg(self.monitor.smoothed_history, bpm)
+            self.ui.draw_ppg(self.monitor.display_history, bpm)
         elif self.current_menu == "hrv_results":
             self.ui.display_hrv_metrics(self.hrv_metrics)
         elif self.current_menu == "kubios_results":
-            self.ui.display_kubios(self.kubios_extracted)
+            self.ui.display_kubios(self.kubios_extracted, self.kubios_source)
         elif self.current_menu == "kubios_menu":
             self.ui.hrv_menu()
+        elif self.current_menu == "diagnostics":
+            self.ui.diagnostics(self.stats.snapshot())
  
+    async def render(self):
+        """  REDRAW ONLY WHEN THE MENU STATE CHANGED, OR AT THE PLOT RATE ON THE HEARTRATE SCREEN  """
+        while True:
+            if self.current_menu == "heart_rate" and self.running:
+                self.update_ui()
+                await asyncio.sleep_ms(PPG_INTERVAL_MS)
+            elif self.current_menu == "diagnostics":
+                #### REFRESH EVERY SECOND, BUT LEAVE AS SOON AS THE INPUT TASK CHANGES THE MENU
+                self.ui_changed.clear()
+                self.update_ui()
+                try:
+                    await asyncio.wait_for_ms(self.ui_changed.wait(), 1000)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.ui_changed.wait()
+                self.ui_changed.clear()
+                self.update_ui()
+
+    async def refine_with_kubios(self, id, intervals):
+        """ Asks Kubios for the analysis the local results on screen came from, in the background.
+            Its reply, when one comes, replaces them and is published and saved to history as well,
+            marked with source "kubios" where the local ones say "local" """
+        try:
+            kubios_response = await self.network.send_kubios(id, intervals)
+            if kubios_response and kubios_response.get("data", {}).get("status") == "ok":
+                extracted = self.ui.kubios_extract(kubios_response)
+                if self.id == id:
+                    self.kubios_extracted = extracted
+                    self.kubios_source = "KUBIOS"
+                    self.ui_changed.set()
+                self.network.send_kubios_data(kubios_response, "hr-data")
+                self.history.append_metrics_to_history(extracted, "kubios")
+        except Exception as e:
+            print(f"Kubios processing failed: {e}")
+
     async def run(self):
-        """   MAIN LOOP  """
-        self.network.connect_wifi()
+        """   MAIN LOOP, INPUT TASK. SAMPLING, RENDERING AND THE DISPLAY RUN AS THEIR OWN TASKS  """
+        asyncio.create_task(self.network.run())
+        asyncio.create_task(self.display.run())
+        asyncio.create_task(self.monitor.run())
+        asyncio.create_task(self.render())
+        if self.stats.enabled:
+            asyncio.create_task(self.stats.run(self.network, STATS_TOPIC, STATS_INTERVAL_MS))
         self.update_ui()
         while True:
-            # Process encoder input
+            await self.enc.flag.wait()
+            if self.stats.enabled:
+                self.stats.input_wakeup()
             while self.enc.fifo.has_data():
                 fifo = self.enc.fifo.get()
                 self.handle_input(fifo)
                                                   ##### HANDLE BASIC HRV MEASUREMENT ####
                 if self.current_menu == "measuring_hrv":
                     try:
-                        self.network.connect_mqtt(21883)
                         results = await asyncio.gather(
-                            self.ui.loading_bar(30),
+                            self.ui.loading_bar(self.hrv_monitor.collection_duration // 1000, self.hrv_monitor.live_metrics),
                             self.hrv_monitor.calculate_all_metrics()
                         )
                         self.hrv_metrics = results[1]
@@ -105,35 +178,25 @@ class MainMenu:
                                                     ##### HANDLE KUBIOS ADVANCED HRV #####
                 elif self.current_menu == "kubios_measure":
                     try:
-                        self.network.connect_mqtt(21883)
                         results = await asyncio.gather(
-                            self.ui.loading_bar(30),
+                            self.ui.loading_bar(self.hrv_monitor.collection_duration // 1000, self.hrv_monitor.live_metrics),
                             self.hrv_monitor.collect_data()
                         )
                         self.id += 1
                         self.intervals = self.hrv_monitor.intervals
-                        kubios_response = self.network.send_kubios(self.id, self.intervals)
-                        self.network.send_kubios_data(kubios_response, "hr-data")
-                        self.kubios_extracted = self.ui.kubios_extract(kubios_response)
-                        self.history.append_metrics_to_history(self.kubios_extracted)
+                        #### LOCAL RESULTS GO ON SCREEN, OUT AND INTO HISTORY RIGHT AWAY, KUBIOS FOLLOWS WHEN IT ANSWERS
+                        local = self.frequency.analyse(self.intervals, self.id)
+                        self.kubios_extracted = self.ui.kubios_extract(local)
+                        self.kubios_source = "LOCAL"
                         self.current_menu = "kubios_results"
+                        self.network.send_kubios_data(local, "hr-data")
+                        self.history.append_metrics_to_history(self.kubios_extracted, "local")
+                        asyncio.create_task(self.refine_with_kubios(self.id, self.intervals))
                     except Exception as e:
                         print(f"Kubios processing failed: {e}")
                         self.current_menu = "main"
 
-            #### UPDATE THE PPG AND HEARTRATE ####
-            current_time = time.ticks_ms()
-            if self.current_menu == "heart_rate" and self.running:
-                if time.ticks_diff(current_time, self.last_ppg_time) >= 50:
-                    self.monitor.process()
-                    self.update_ui()
-                    self.last_ppg_time = current_time
-            else:
-                if time.ticks_diff(current_time, self.last_display_time) >= 100:
-                    self.update_ui()
-                    self.last_display_time = current_time
-
-            await asyncio.sleep_ms(5)
+            self.ui_changed.set()
 
 if __name__ == "__main__":
     menu = MainMenu()
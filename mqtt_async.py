@@ -0,0 +1,135 @@
+import uasyncio as asyncio
+import time
+
+class MQTTException(Exception):
+    pass
+
+class MQTTClient:
+    """ Small MQTT 3.1.1 client on top of uasyncio streams. Publishes with QoS 0 or 1, subscribes with QoS 0.
+        Same shape as umqtt.simple, but every call awaits instead of blocking the scheduler.
+        Incoming messages are read by wait_msg(), which the owner runs in its own task.
+        A QoS 1 publish waits until wait_msg() sees the broker acknowledge it """
+    def __init__(self, client_id, server, port=1883, keepalive=0):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.cb = None
+        self.reader = None
+        self.writer = None
+        self.pid = 0
+        self.acks = {}
+        self.last_rx = time.ticks_ms() #### WHEN WE LAST HEARD FROM THE BROKER, FOR DEAD SOCKET DETECTION
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def encode_length(self, length):
+        out = bytearray()
+        while True:
+            byte = length & 0x7F
+            length >>= 7
+            if length:
+                byte |= 0x80
+            out.append(byte)
+            if not length:
+                return out
+
+    def encode_string(self, value):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        return len(value).to_bytes(2, "big") + value
+
+    async def send_packet(self, header, body):
+        self.writer.write(bytes([header]) + self.encode_length(len(body)) + body)
+        await self.writer.drain()
+
+    async def read_packet(self):
+        header = (await self.reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await self.reader.readexactly(length) if length else b""
+        self.last_rx = time.ticks_ms()
+        return header, body
+
+    async def connect(self, clean_session=True, timeout_ms=5000):
+        self.reader, self.writer = await asyncio.wait_for_ms(
+            asyncio.open_connection(self.server, self.port), timeout_ms)
+        body = self.encode_string("MQTT") + bytes([4, 0x02 if clean_session else 0]) \
+            + self.keepalive.to_bytes(2, "big") + self.encode_string(self.client_id)
+        await self.send_packet(0x10, body)
+        header, body = await asyncio.wait_for_ms(self.read_packet(), timeout_ms)
+        if header != 0x20 or len(body) != 2:
+            self.close()
+            raise MQTTException("unexpected reply to CONNECT")
+        if body[1] != 0:
+            self.close()
+            raise MQTTException(body[1])
+
+    def next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    async def publish(self, topic, msg, retain=False, qos=0, timeout_ms=5000):
+        if isinstance(msg, str):
+            msg = msg.encode("utf-8")
+        header = 0x30 | qos << 1 | retain
+        if not qos:
+            await self.send_packet(header, self.encode_string(topic) + msg)
+            return
+        pid = self.next_pid()
+        acked = asyncio.Event()
+        self.acks[pid] = acked
+        try:
+            await self.send_packet(header, self.encode_string(topic) + pid.to_bytes(2, "big") + msg)
+            await asyncio.wait_for_ms(acked.wait(), timeout_ms)
+        except asyncio.TimeoutError:
+            raise MQTTException("no PUBACK")
+        finally:
+            del self.acks[pid]
+
+    async def subscribe(self, topic):
+        self.next_pid()
+        await self.send_packet(0x82, self.pid.to_bytes(2, "big") + self.encode_string(topic) + b"\x00")
+
+    async def ping(self):
+        await self.send_packet(0xC0, b"")
+
+    async def wait_msg(self):
+        """ Reads one packet, hands PUBLISH messages to the callback and returns the packet type """
+        header, body = await self.read_packet()
+        kind = header & 0xF0
+        if kind == 0x30:
+            topic_length = int.from_bytes(body[:2], "big")
+            topic = body[2:2 + topic_length]
+            start = 2 + topic_length
+            qos = (header >> 1) & 0x03
+            if qos:
+                pid = body[start:start + 2]
+                start += 2
+                await self.send_packet(0x40, pid)
+            if self.cb:
+                self.cb(topic, body[start:])
+        elif kind == 0x40:
+            acked = self.acks.get(int.from_bytes(body[:2], "big"))
+            if acked:
+                acked.set()
+        return kind
+
+    async def disconnect(self):
+        try:
+            await self.send_packet(0xE0, b"")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
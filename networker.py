@@ -1,44 +1,254 @@
-import mip
 import network
 import json
-import urequests as requests
 import time
-from umqtt.simple import MQTTClient
+from mqtt_async import MQTTClient
+from outbox import Outbox
+import jsonscan
+import uasyncio as asyncio
 import random
+import hashlib
+from array import array
+
+#### THE ONLY PARTS OF A KUBIOS REPLY THAT ARE USED, SEE KubiosRequests, MainMenu.refine_with_kubios,
+#### UI.kubios_extract AND Network.send_kubios_data
+KUBIOS_FIELDS = jsonscan.fields(
+    "id", "data.status",
+    "data.analysis.mean_hr_bpm", "data.analysis.mean_rr_ms",
+    "data.analysis.rmssd_ms", "data.analysis.sdnn_ms", "data.analysis.pns_index",
+    "data.analysis.sns_index", "data.analysis.stress_index", "data.analysis.readiness",
+    "data.analysis.freq_domain.LF_HF_power",
+)
+
+class KubiosRequests:
+    """ Kubios requests waiting for their reply, keyed by request id, so several can be in flight and a late
+        reply to an earlier request is never taken as the answer to the current one.
+        A request that times out is forgotten and its reply, if it still comes, is ignored.
+
+        Successful analyses are kept in a small LRU cache keyed by a hash of the interval list,
+        so sending the same intervals again does not need a round-trip """
+    def __init__(self, cache_size=4):
+        self.pending = {}
+        self.cache_size = cache_size
+        self.cache = {}
+        self.cache_order = []
+        self.stale = 0
+
+    def key(self, intervals):
+        return hashlib.sha256(array("I", intervals)).digest()
+
+    def cached(self, key):
+        if key not in self.cache:
+            return None
+        self.cache_order.remove(key)
+        self.cache_order.append(key)
+        return self.cache[key]
+
+    def remember(self, key, response):
+        if key in self.cache:
+            self.cache_order.remove(key)
+        elif len(self.cache_order) >= self.cache_size:
+            del self.cache[self.cache_order.pop(0)]
+        self.cache[key] = response
+        self.cache_order.append(key)
+
+    def open(self, id):
+        """ Registers a request. The returned entry holds an event and, once it is set, the reply """
+        entry = [asyncio.Event(), None]
+        self.pending[id] = entry
+        return entry
+
+    def close(self, id):
+        self.pending.pop(id, None)
+
+    def resolve(self, message):
+        """ Hands a reply to the request with the same id. Returns False for replies nobody waits for """
+        entry = self.pending.get(str(message.get("id")))
+        if entry is None:
+            self.stale += 1
+            return False
+        entry[1] = message
+        entry[0].set()
+        return True
 
 class Network:
-    def __init__(self, ssid, password, broker_ip, client_id=""):
+    """ Wi-Fi and MQTT for the device. Every call that waits on the network is a coroutine,
+        so the display, the encoder and sampling keep running meanwhile.
+
+        run() keeps a single MQTT session alive for the lifetime of the device: it pings the broker,
+        notices when the connection has died and reconnects with exponential backoff.
+        Subscriptions are made once per session, so sending a measurement is just one publish.
+
+        Measurements are not published directly but put in a flash backed outbox. While a session is up
+        a forwarder task sends them in batches with QoS 1. A message leaves the outbox only once the broker
+        has acknowledged it, so a result never waits on the broker and survives it being away """
+    def __init__(self, ssid, password, broker_ip, client_id="", port=21883, keepalive=60,
+                 subscriptions=("kubios-response",), outbox_size=50, batch_size=10):
         self.ssid = ssid
         self.password = password
         self.broker_ip = broker_ip
         self.client_id = client_id
+        self.port = port
+        self.keepalive = keepalive
+        self.subscriptions = list(subscriptions)
+        self.min_backoff_ms = 1000
+        self.max_backoff_ms = 60000
         self.wlan = network.WLAN(network.STA_IF)
         self.mqtt_client = None
-        self.last_message = None
+        self.listener = None
+        self.forwarder = None
+        self.outbox = Outbox(max_messages=outbox_size)
+        self.batch_size = batch_size
+        self.outbox_ready = asyncio.Event()
+        self.kubios = KubiosRequests()
+        self.connected = asyncio.Event()
+        self.lost = asyncio.Event()
+        self.sessions = 0
 
-    def connect_wifi(self):
+    async def connect_wifi(self, timeout_ms=20000):
         self.wlan.active(True)
         self.wlan.connect(self.ssid, self.password)
+        start_time = time.ticks_ms()
         while not self.wlan.isconnected():
+            if time.ticks_diff(time.ticks_ms(), start_time) > timeout_ms:
+                print("Wi-Fi connection timed out.")
+                return False
             print("Connecting to Wi-Fi...")
-            time.sleep(1)
+            await asyncio.sleep_ms(500)
         print("Connected to Wi-Fi. IP:", self.wlan.ifconfig()[0])
+        return True
+
+    async def connect_mqtt(self):
+        client = MQTTClient(self.client_id, self.broker_ip, port=self.port, keepalive=self.keepalive)
+        client.set_callback(self._mqtt_callback)
+        await client.connect(clean_session=True)
+        self.mqtt_client = client
+        self.lost.clear()
+        self.listener = asyncio.create_task(self._listen(client))
+        for topic in self.subscriptions:
+            await client.subscribe(topic)
+        self.sessions += 1
+        self.forwarder = asyncio.create_task(self._forward(client))
+        self.connected.set()
+        print(f"Connected to MQTT broker on port {self.port}.")
+
+    def drop_connection(self):
+        self.connected.clear()
+        if self.listener:
+            self.listener.cancel()
+            self.listener = None
+        if self.forwarder:
+            self.forwarder.cancel()
+            self.forwarder = None
+        if self.mqtt_client:
+            self.mqtt_client.close()
+            self.mqtt_client = None
+
+    async def _listen(self, client):
+        """ Reads incoming packets for as long as the connection lives """
+        try:
+            while True:
+                await client.wait_msg()
+        except Exception as e:
+            print(f"MQTT connection lost: {e}")
+            self.lost.set()
+
+    async def _forward(self, client):
+        """ Drains the outbox in batches for as long as the connection lives """
+        while True:
+            while len(self.outbox):
+                sent = 0
+                try:
+                    for topic, payload in self.outbox.peek(self.batch_size):
+                        await client.publish(topic, payload, qos=1)
+                        print(f"Sending to MQTT: {topic} -> {payload}")
+                        sent += 1
+                except Exception as e:
+                    print(f"MQTT publish failed: {e}")
+                    self.lost.set()
+                    return
+                finally:
+                    self.outbox.remove(sent)
+            self.outbox_ready.clear()
+            await self.outbox_ready.wait()
+
+    async def publish_live(self, topic, message):
+        """ Publishes right away with QoS 0, skipping the outbox, for data only worth having while it is fresh.
+            Returns False when there is no session to publish on """
+        if not self.connected.is_set():
+            return False
+        try:
+            await self.mqtt_client.publish(topic, message)
+            return True
+        except Exception as e:
+            print(f"MQTT publish failed: {e}")
+            self.lost.set()
+            return False
+
+    def queue(self, topic, message):
+        """ Hands a message to the outbox. It goes out now if connected, otherwise after the next reconnect """
+        self.outbox.put(topic, message)
+        self.outbox_ready.set()
 
-    def install_mqtt_library(self):
-        mip.install("umqtt.simple")
+    async def keep_alive(self):
+        """ Returns when the session is dead: the listener hit an error, or the broker stopped answering pings """
+        client = self.mqtt_client
+        interval = self.keepalive * 1000 // 2
+        while True:
+            try:
+                await asyncio.wait_for_ms(self.lost.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if time.ticks_diff(time.ticks_ms(), client.last_rx) > self.keepalive * 1000 + interval:
+                print("MQTT broker stopped answering.")
+                return
+            await client.ping()
 
-    def connect_mqtt(self, port=21883):
-        self.mqtt_client = MQTTClient(self.client_id, self.broker_ip, port=port)
-        self.mqtt_client.set_callback(self._mqtt_callback)
-        self.mqtt_client.connect(clean_session=True)
-        print(f"Connected to MQTT broker on port {port}.")
+    async def run(self):
+        """ Connection supervisor task """
+        backoff = self.min_backoff_ms
+        while True:
+            try:
+                if self.wlan.isconnected() or await self.connect_wifi():
+                    await self.connect_mqtt()
+                    backoff = self.min_backoff_ms
+                    await self.keep_alive()
+            except Exception as e:
+                print(f"MQTT connection failed: {e}")
+            self.drop_connection()
+            delay = backoff + random.randint(0, backoff // 4)
+            print(f"Reconnecting in {delay} ms.")
+            await asyncio.sleep_ms(delay)
+            backoff = min(backoff * 2, self.max_backoff_ms)
+
+    async def wait_connected(self, timeout_ms=5000):
+        if self.connected.is_set():
+            return True
+        try:
+            await asyncio.wait_for_ms(self.connected.wait(), timeout_ms)
+            return True
+        except asyncio.TimeoutError:
+            return False
 
     def _mqtt_callback(self, topic, msg):
-        print(f"Received MQTT message on topic {topic}: {msg}")
-        self.last_message = json.loads(msg.decode('utf-8'))
+        print(f"Received MQTT message on topic {topic}: {len(msg)} bytes")
+        try:
+            if topic == b"kubios-response":
+                #### KUBIOS REPLIES ARE LARGE, DECODE ONLY THE FIELDS WE SHOW AND SEND ON
+                if not self.kubios.resolve(jsonscan.extract(msg, KUBIOS_FIELDS)):
+                    print("Ignoring a Kubios reply nobody is waiting for.")
+        except ValueError as e:
+            print(f"Unreadable MQTT message: {e}")
 
+    async def send_kubios(self, id, data, timeout=10):
+        """ Sends the intervals to Kubios and returns its reply, or None on a timeout.
+            Any number of these can wait at once, each gets the reply carrying its own id """
+        key = self.kubios.key(data)
+        cached = self.kubios.cached(key)
+        if cached is not None:
+            print("Kubios analysis found in cache.")
+            return cached
 
-    def send_kubios(self, id, data, response_topic="kubios-response", timeout=10):
         raw_data = {
             "id": str(id),
             "type": "RRI",
@@ -47,32 +257,27 @@ class Network:
         }
         json_data = json.dumps(raw_data).encode("utf-8")
         
-        if not self.mqtt_client:
+        if not await self.wait_connected():
             print("MQTT client not connected.")
             return None
 
-        self.last_message = None
-        self.mqtt_client.subscribe(response_topic.encode('utf-8'))
-        print(f"Subscribed to response topic: {response_topic}")
-
-        request_topic = "kubios-request"
-        self.mqtt_client.publish(request_topic.encode('utf-8'), json_data)
-        print(f"Sending to MQTT: {request_topic} -> {json_data}")
-
-        start_time = time.ticks_ms()
-        while time.ticks_ms() - start_time < timeout * 1000:
-            self.mqtt_client.check_msg()
-            if self.last_message is not None:
-                return self.last_message
-            time.sleep(0.1)
-
-        print("Timeout waiting for Kubios response.")
-        return None
+        request = self.kubios.open(str(id))
+        try:
+            request_topic = "kubios-request"
+            await self.mqtt_client.publish(request_topic, json_data)
+            print(f"Sending to MQTT: {request_topic} -> {json_data}")
+            await asyncio.wait_for_ms(request[0].wait(), timeout * 1000)
+        except asyncio.TimeoutError:
+            print("Timeout waiting for Kubios response.")
+            return None
+        finally:
+            self.kubios.close(str(id))
+        response = request[1]
+        if response.get("data", {}).get("status") == "ok":
+            self.kubios.remember(key, response)
+        return response
     
     def send_hrv_data(self, metrics, topic):
-        
-        self.mqtt_client.subscribe(topic.encode('utf-8'))
-        
         data ={
             "id": time.time(),
             "timestamp": random.randint(1, 1000),
@@ -84,14 +289,9 @@ class Network:
         
         
         message_json = json.dumps(data)
-        if self.mqtt_client:
-            self.mqtt_client.publish(topic, message_json)
-            print(f"Sending to MQTT: {topic} -> {message_json}")
-        else:
-            print("MQTT client not connected.")
+        self.queue(topic, message_json)
 
     def send_kubios_data(self, health_metrics, topic):
-        self.mqtt_client.subscribe(topic.encode('utf-8'))
         metrics = health_metrics["data"]["analysis"]
         
         data = {
@@ -103,11 +303,79 @@ class Network:
             "sdnn": metrics["sdnn_ms"],
             "sns": metrics["sns_index"],
             "pns": metrics["pns_index"],
+            "lf_hf": metrics.get("freq_domain", {}).get("LF_HF_power"),
+            "source": health_metrics.get("source", "kubios"),
         }
         
         message_json = json.dumps(data)
-        if self.mqtt_client:
-            self.mqtt_client.publish(topic, message_json)
-            print(f"Sending to MQTT: {topic} -> {message_json}")
+        self.queue(topic, message_json)
+
+class RRStreamer:
+    """ Publishes the RR intervals of a measurement while it runs, for a live dashboard.
+        Intervals are gathered into a batch that is sent when it holds batch_size intervals
+        or at the latest max_latency_ms after the batch was started.
+
+        add() only appends to the batch, so it is safe to call from the sampling task.
+        Publishing happens in the streamer's own task, and a batch that cannot be sent is dropped.
+        Every batch carries the measurement number and a sequence number that starts from 0
+        in each measurement, so a receiver can tell when batches are missing. Each measurement's
+        task keeps its own batch, event and sequence number, so a new measurement can start while
+        the previous task is still sending its last batch """
+    def __init__(self, network, topic="hr-rr", batch_size=5, max_latency_ms=2000):
+        self.network = network
+        self.topic = topic
+        self.batch_size = batch_size
+        self.max_latency_ms = max_latency_ms
+        self.batch = []
+        self.started_ms = 0
+        self.measurement = 0
+        self.sent = 0
+        self.dropped = 0
+        self.ready = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.measurement += 1
+        self.batch = []
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self.run(self.measurement, self.batch, self.ready))
+
+    def add(self, interval):
+        if not self.batch:
+            self.started_ms = time.ticks_ms()
+        self.batch.append(interval)
+        if len(self.batch) >= self.batch_size:
+            self.ready.set()
+
+    def stop(self):
+        """ Ends the measurement. The task sends what is left as the last batch and exits """
+        self.task = None
+        self.ready.set()
+
+    async def run(self, measurement, batch, ready):
+        seq = 0
+        while True:
+            if batch:
+                wait = self.max_latency_ms - time.ticks_diff(time.ticks_ms(), self.started_ms)
+            else:
+                wait = self.max_latency_ms
+            if wait > 0 and not ready.is_set():
+                try:
+                    await asyncio.wait_for_ms(ready.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            ready.clear()
+            last = self.task is None or self.measurement != measurement
+            if batch or last:
+                await self.send(measurement, seq, batch, last)
+                seq += 1
+            if last:
+                return
+
+    async def send(self, measurement, seq, batch, last):
+        message = json.dumps({"measurement": measurement, "seq": seq, "last": last, "rr": batch})
+        del batch[:]
+        if await self.network.publish_live(self.topic, message):
+            self.sent += 1
         else:
-            print("MQTT client not connected.")
+            self.dropped += 1
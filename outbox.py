@@ -0,0 +1,93 @@
+import json
+import os
+
+class Outbox:
+    """ Messages waiting for the broker, kept in flash so a dead connection or a reboot does not lose them.
+        A new message is appended to the end of the file. Sent messages are cut from the front by rewriting
+        the file once per batch, so flash is written once per message and once per batch.
+
+        The queue holds at most max_messages. When it is full the oldest message is dropped to make room,
+        newer results being worth more than older ones. Messages handed out by peek() are in flight and are
+        never dropped, so remove() always forgets the ones that were sent """
+    def __init__(self, path="outbox.log", max_messages=50):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.max_messages = max_messages
+        self.messages = []
+        self.in_flight = 0
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.load()
+
+    def load(self):
+        """ Picks up messages left from before a reboot. A line cut short by a power loss is skipped """
+        try:
+            f = open(self.path, "r")
+        except OSError:
+            return
+        clean = True
+        with f:
+            for line in f:
+                try:
+                    topic, payload = json.loads(line)
+                    self.messages.append((topic, payload))
+                except ValueError:
+                    clean = False
+        if len(self.messages) > self.max_messages:
+            self.dropped += len(self.messages) - self.max_messages
+            del self.messages[:len(self.messages) - self.max_messages]
+            clean = False
+        if not clean:
+            self.save()
+
+    def save(self):
+        """ Rewrites the file with the messages still waiting """
+        if not self.messages:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            return
+        with open(self.tmp_path, "w") as f:
+            for message in self.messages:
+                f.write(json.dumps(message) + "\n")
+        try:
+            os.rename(self.tmp_path, self.path)
+        except OSError:
+            os.remove(self.path)
+            os.rename(self.tmp_path, self.path)
+
+    def put(self, topic, payload):
+        self.queued += 1
+        if len(self.messages) >= self.max_messages and self.in_flight < len(self.messages):
+            self.messages.pop(self.in_flight)
+            self.dropped += 1
+            self.messages.append((topic, payload))
+            self.save()
+            return
+        self.messages.append((topic, payload))
+        with open(self.path, "a") as f:
+            f.write(json.dumps((topic, payload)) + "\n")
+
+    def peek(self, count):
+        """ The oldest messages, at most count of them. They stay in flight until the next remove() """
+        batch = self.messages[:count]
+        self.in_flight = len(batch)
+        return batch
+
+    def remove(self, count):
+        """ Forgets the first count messages of the batch in flight once they have been sent, the rest
+            of the batch goes out again with the next peek() """
+        self.in_flight = 0
+        if not count:
+            return
+        del self.messages[:count]
+        self.sent += count
+        self.save()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def stats(self):
+        return {"queued": self.queued, "sent": self.sent, "dropped": self.dropped, "pending": len(self.messages)}
@@ -0,0 +1,126 @@
+import gc
+import json
+import time
+import uasyncio as asyncio
+
+class Stage:
+    """ Call count and min/avg/max duration of one timed stage, in microseconds """
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def add(self, us):
+        if not self.count or us < self.min:
+            self.min = us
+        if us > self.max:
+            self.max = us
+        self.count += 1
+        self.total += us
+
+    def avg(self):
+        return self.total // self.count if self.count else 0
+
+class FifoProbe:
+    """ level(), capacity and dropped() for a pico-lib Fifo, which keeps one slot free """
+    def __init__(self, fifo):
+        self.fifo = fifo
+        self.capacity = fifo.size - 1
+
+    def level(self):
+        return (self.fifo.head - self.fifo.tail) % self.fifo.size
+
+    def dropped(self):
+        return self.fifo.dropped()
+
+class Stats:
+    """ Counters that tell whether the device is falling behind: how long each stage takes,
+        how full the FIFOs got and how many values they dropped, how often the input task wakes up
+        and how long garbage collection takes. Everything counts from boot.
+
+        instrument() times a method by replacing it on that one object with a wrapper.
+        When stats are disabled nothing is wrapped, so the measured code runs exactly as before.
+        FIFO levels are sampled before every timed stage and every wakeup of the input task, which
+        for a FIFO drained by a timed stage is the moment it is fullest """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started = time.ticks_ms()
+        self.stages = {}
+        self.fifos = {}
+        self.sources = {}
+        self.input_wakeups = 0
+
+    def instrument(self, obj, method, name=None):
+        if not self.enabled:
+            return
+        stage = self.stages[name or method] = Stage()
+        original = getattr(obj, method)
+        check_fifos = self.check_fifos
+
+        def timed(*args):
+            check_fifos()
+            start = time.ticks_us()
+            result = original(*args)
+            stage.add(time.ticks_diff(time.ticks_us(), start))
+            return result
+        setattr(obj, method, timed)
+
+    def watch(self, name, fifo):
+        """ fifo has level(), capacity and dropped(), a plain pico-lib Fifo is wrapped in a FifoProbe """
+        if not hasattr(fifo, "level"):
+            fifo = FifoProbe(fifo)
+        self.fifos[name] = [fifo, 0]
+
+    def add_source(self, name, stats):
+        """ stats() returns a dict of counters kept elsewhere, included as they are """
+        self.sources[name] = stats
+
+    def check_fifos(self):
+        for entry in self.fifos.values():
+            level = entry[0].level()
+            if level > entry[1]:
+                entry[1] = level
+
+    def input_wakeup(self):
+        """ Counts one wakeup of the input task, which sleeps until the encoder has something """
+        self.input_wakeups += 1
+        self.check_fifos()
+
+    def collect_garbage(self):
+        """ A timed collection at a moment of our choosing keeps the automatic ones short """
+        stage = self.stages.get("gc")
+        if stage is None:
+            stage = self.stages["gc"] = Stage()
+        start = time.ticks_us()
+        gc.collect()
+        stage.add(time.ticks_diff(time.ticks_us(), start))
+
+    def uptime_ms(self):
+        return time.ticks_diff(time.ticks_ms(), self.started)
+
+    def snapshot(self):
+        seconds = max(1, self.uptime_ms()) / 1000
+        data = {
+            "uptime_s": round(seconds),
+            "input_wakeups_per_s": round(self.input_wakeups / seconds, 1),
+            "mem_free": gc.mem_free(),
+            "stages": {},
+            "fifos": {},
+        }
+        for name, stage in self.stages.items():
+            data["stages"][name] = {"count": stage.count, "per_s": round(stage.count / seconds, 1),
+                                    "min_us": stage.min, "avg_us": stage.avg(), "max_us": stage.max}
+        for name, (fifo, high) in self.fifos.items():
+            data["fifos"][name] = {"size": fifo.capacity, "high": high, "dropped": fifo.dropped()}
+        for name, stats in self.sources.items():
+            data[name] = stats()
+        return data
+
+    async def run(self, network=None, topic=None, interval_ms=10000):
+        """ Collects garbage every interval and publishes a snapshot when a topic is given """
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            self.collect_garbage()
+            if network and topic:
+                await network.publish_live(topic, json.dumps(self.snapshot()))
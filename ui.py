@@ -1,23 +1,115 @@
-from machine import Pin, I2C
-from ssd1306 import SSD1306_I2C
-
 import json
 import time
 import uasyncio as asyncio
 
+class PPGPlot:
+    """ Scrolling waveform of the last `width` samples of a SampleBuffer.
+        Each frame shifts the plot left and only draws the samples that arrived since the last frame.
+        The y scale is integer and only changes when a sample falls outside the plotted range, or when
+        the signal has shrunk to under half of it, so small drifts don't cause full redraws """
+    def __init__(self, oled, width=120, top=3, height=50):
+        self.oled = oled
+        self.width = width
+        self.top = top
+        self.height = height
+        self.bottom = top + height
+        self.data = None
+        self.written = 0
+        self.clears = -1
+        self.lo = 0
+        self.hi = 0
+        self.span = 1
+        self.last_y = self.bottom
+        self.since_check = 0
+        self.full_redraws = 0
+
+    def scale(self, value):
+        y = self.bottom - (value - self.lo) * self.height // self.span
+        if y < self.top:
+            return self.top
+        if y > self.bottom:
+            return self.bottom
+        return y
+
+    def window_range(self, data):
+        start = len(data) - self.width
+        low = high = data[start]
+        for i in range(start + 1, start + self.width):
+            value = data[i]
+            if value < low:
+                low = value
+            elif value > high:
+                high = value
+        return low, high
+
+    def redraw(self, data):
+        """ Pick a new scale with some headroom and draw the whole window """
+        low, high = self.window_range(data)
+        margin = (high - low) // 8
+        self.lo = low - margin
+        self.hi = high + margin
+        self.span = (self.hi - self.lo) or 1
+        self.since_check = 0
+        self.full_redraws += 1
+
+        self.oled.fill(0)
+        start = len(data) - self.width
+        y1 = self.scale(data[start])
+        for i in range(1, self.width):
+            y2 = self.scale(data[start + i])
+            self.oled.line(i - 1, y1, i, y2, 1)
+            y1 = y2
+        self.last_y = y1
+        self.clears = self.oled.clears
+
+    def needs_redraw(self, data, new):
+        """ fill() is how every other screen starts, so a changed clear count means someone drew over us """
+        if data is not self.data or self.clears != self.oled.clears or new < 0 or new >= self.width:
+            return True
+        count = len(data)
+        for i in range(count - new, count):
+            value = data[i]
+            if value < self.lo or value > self.hi:
+                return True
+        self.since_check += new
+        if self.since_check >= self.width:
+            self.since_check = 0
+            low, high = self.window_range(data)
+            if (high - low) * 2 < self.span:
+                return True
+        return False
+
+    def draw(self, data):
+        new = data.written - self.written
+        if self.needs_redraw(data, new):
+            self.data = data
+            self.redraw(data)
+        elif new:
+            width = self.width
+            self.oled.scroll(-new, 0)
+            self.oled.fill_rect(width - new, 0, self.oled.width - width + new, self.bottom + 1, 0)
+            count = len(data)
+            y1 = self.last_y
+            x = width - new
+            for i in range(count - new, count):
+                y2 = self.scale(data[i])
+                self.oled.line(x - 1, y1, x, y2, 1)
+                y1 = y2
+                x += 1
+            self.last_y = y1
+        self.written = data.written
+
 class UI:
-    def __init__(self, options, selected, bpm, hrv_calculator=None):
-        self.i2c = I2C(1, scl=Pin(15), sda=Pin(14), freq=400000)
-        self.oled_width = 128
-        self.oled_height = 64
-        self.oled = SSD1306_I2C(self.oled_width, self.oled_height, self.i2c)
+    def __init__(self, options, selected, bpm, display):
+        self.oled = display
+        self.oled_width = display.width
+        self.oled_height = display.height
         
         self.options = options
         self.selected = selected
         self.bpm = bpm 
-        self.hrv_calculator = hrv_calculator
         
-        self.latest_time = None
+        self.ppg_plot = PPGPlot(display)
 
     def invert_text(self, text, x, y, selected=False):
         if selected:
@@ -31,7 +123,7 @@ class UI:
         self.oled.fill(0)
         for option in range(len(self.options)):
             self.invert_text(self.options[option], 1, (option + 1) * 10, option == self.selected)
-        self.oled.show()
+        self.oled.update()
 
     """draw the realtime ppg when user is measuring heartrate """
     def draw_ppg(self, data, bpm):
@@ -41,27 +133,16 @@ class UI:
             self.oled.text("HOLD FINGER", 18, 16, 1)
             self.oled.text("ON SENSOR", 24, 24, 1)
             self. invert_text("PRESS TO EXIT", 8, 50, True)
-            self.oled.show()
+            self.oled.update()
             return False
 
-
-        data_window = data[-120:]
-
-        min_val = min(data_window)
-        max_val = max(data_window)
-
-        self.oled.fill(0)
-        for i in range(len(data_window) - 1):
-            y1 = 53 - int((data_window[i] - min_val) / (max_val - min_val) * 50)
-            x1 = i
-            y2 = 53 - int((data_window[i + 1] - min_val) / (max_val - min_val) * 50)
-            x2 = i + 1
-            self.oled.line(x1, y1, x2, y2, 1)
+        self.ppg_plot.draw(data)
 
         bpm_text = f"{bpm} BPM" if 30 <= bpm <= 200 else "-- BPM"
+        self.oled.fill_rect(0, 54, self.oled_width, 10, 0)
         self.invert_text(bpm_text, 60, 55, True)
 
-        self.oled.show()
+        self.oled.update()
         return True
 
     def hrv_menu(self):
@@ -69,12 +150,28 @@ class UI:
         self.oled.text("PLACE FINGER", 18, 16, 1)
         self.oled.text("ON SENSOR", 30, 24, 1)
         self.invert_text("PRESS TO START", 10, 40, True)
-        self.oled.show()
+        self.oled.update()
         
-    def hrv_measuring(self):
+    def diagnostics(self, snapshot):
+        """ One line per timed stage as avg/max, then FIFO high-water/capacity and overflows """
         self.oled.fill(0)
-        self.oled.text("Calculating...", 4, 42, 1)
-        self.oled.show()
+        self.invert_text("DIAGNOSTICS", 20, 0, True)
+        y = 8
+        for key, label in (("process", "PROC"), ("draw_ppg", "DRAW"), ("show", "SHOW")):
+            stage = snapshot["stages"].get(key)
+            if stage:
+                self.oled.text(f"{label} {stage['avg_us'] / 1000:.1f}/{stage['max_us'] / 1000:.1f}ms", 0, y, 1)
+                y += 8
+        for key, label in (("adc", "ADC"), ("encoder", "ENC")):
+            fifo = snapshot["fifos"].get(key)
+            if fifo:
+                self.oled.text(f"{label} {fifo['high']}/{fifo['size']} OV{fifo['dropped']}", 0, y, 1)
+                y += 8
+        self.oled.text(f"INPUT {snapshot['input_wakeups_per_s']}/s", 0, y, 1)
+        gc_stage = snapshot["stages"].get("gc")
+        if gc_stage:
+            self.oled.text(f"GC {gc_stage['max_us'] / 1000:.1f}ms", 0, y + 8, 1)
+        self.oled.update()
 
     def display_hrv_metrics(self, metrics):
         self.oled.fill(0)
@@ -84,10 +181,10 @@ class UI:
         self.oled.text(f"RMSSD: {metrics['RMSSD_MS']:.1f} ms", 4, 32, 1)
         self.oled.text(f"SDNN: {metrics['SDNN_MS']:.1f} ms", 4, 42, 1)
         self.invert_text("PRESS TO EXIT", 10, 53, True)
-        self.oled.show()
+        self.oled.update()
 
-    """ loading bar to give a bit of user feedback """
-    async def loading_bar(self, seconds):
+    """ loading bar to give a bit of user feedback, live() can return the metrics collected so far """
+    async def loading_bar(self, seconds, live=None):
         self.oled.fill(0)
         self.oled.text("MEASURING..", 4, 10, 1)
         bar_x, bar_y = 4, 30
@@ -99,10 +196,18 @@ class UI:
             progress = time.ticks_diff(time.ticks_ms(), start_time) / duration_ms
             fill_width = int(bar_width * progress)
             self.oled.fill_rect(bar_x, bar_y, fill_width, bar_height, 1)
-            self.oled.show()
+            if live:
+                self.live_metrics(live())
+            self.oled.update()
             await asyncio.sleep_ms(50)
         self.oled.fill_rect(bar_x, bar_y, bar_width, bar_height, 1)
-        self.oled.show()
+        self.oled.update()
+
+    def live_metrics(self, metrics):
+        self.oled.fill_rect(0, 44, self.oled_width, 20, 0)
+        if metrics and metrics['INTERVAL_COUNT']:
+            self.oled.text(f"HR: {metrics['MEAN_HR_BPM']:.0f} BPM", 4, 44, 1)
+            self.oled.text(f"RMSSD: {metrics['RMSSD_MS']:.0f} ms", 4, 54, 1)
 
     """Extract only necessary data from the kubios response """
     def kubios_extract(self, metrics):
@@ -116,9 +221,7 @@ class UI:
         rmssd = metrics["rmssd_ms"]
         pns_index = metrics["pns_index"]
         sns_index = metrics["sns_index"]
-        time_stamp = metrics["create_timestamp"]
-        
-        self.latest_time = time_stamp
+        lf_hf = metrics.get("freq_domain", {}).get("LF_HF_power")
         
         sorted_metrics.append({"HR": heart_rate})
         
@@ -157,13 +260,17 @@ class UI:
         else:
             sorted_metrics.append({"SNS": "HIGH"})
         
+        if lf_hf is not None:
+            sorted_metrics.append({"LF/HF": lf_hf})
+        
         return sorted_metrics
     
     
-    def display_kubios(self, metrics):
+    def display_kubios(self, metrics, source="KUBIOS"):
         self.oled.fill(0)
-        self.invert_text("RESULTS KUBIOS", 8, 0, True)
-        y = 9
+        title = "RESULTS " + source
+        self.invert_text(title, 64 - len(title) * 4, 0, True)
+        y = 8
         row = 1
         
         sorted_metrics = metrics
@@ -172,12 +279,14 @@ class UI:
             key, value = list(metric_dict.items())[0]
             if key == "HR":
                 text = f"{key}: {value:.1f} BPM"
+            elif key == "LF/HF":
+                text = f"{key}: {value:.2f}"
             else:
                 text = f"{key}: {value}"
             self.oled.text(text, 4, y * row, 1)
             row += 1
             
-        self.oled.show()
+        self.oled.update()
 
 
             